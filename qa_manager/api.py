@@ -1,7 +1,14 @@
-from ninja import NinjaAPI
-from tests.api import project_router, section_router, testcase_router, testrun_router
+from tests.api import (
+    async_router,
+    changes_router,
+    project_router,
+    section_router,
+    testcase_router,
+    testrun_router,
+)
+from tests.metrics import MetricsNinjaAPI
 
-api = NinjaAPI(
+api = MetricsNinjaAPI(
     title="QA Manager API",
     version="0.0.2",
     description="Manage testcases and testruns",
@@ -11,3 +18,5 @@ api.add_router("/projects/", project_router, tags=["Projects"])
 api.add_router("/sections/", section_router, tags=["Sections"])
 api.add_router("/testcases/", testcase_router, tags=["Testcases"])
 api.add_router("/testruns/", testrun_router, tags=["Testruns"])
+api.add_router("/changes/", changes_router, tags=["Changes"])
+api.add_router("/async/", async_router, tags=["Async"])
@@ -0,0 +1,32 @@
+"""
+SQLite backend for single-node deployments.
+
+Two options on top of the ones of sqlite3.connect(), both built into Django
+from 5.1 on:
+
+- "pragmas": PRAGMAs run on every new connection, e.g. WAL journal mode.
+- "transaction_mode": how transactions begin. With "IMMEDIATE" a transaction
+  takes the write lock when it starts. Concurrent writers then wait up to
+  the busy "timeout" instead of failing with "database is locked" when a
+  read inside their transaction has to be upgraded to a write.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.pragmas = params.pop("pragmas", {})
+        self.transaction_mode = params.pop("transaction_mode", None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            connection.execute(f"PRAGMA {name} = {value}")
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode is None:
+            return super()._start_transaction_under_autocommit()
+        self.cursor().execute(f"BEGIN {self.transaction_mode}")
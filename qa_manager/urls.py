@@ -1,8 +1,10 @@
 from django.contrib import admin
 from django.urls import path
+from tests.metrics import metrics_view
 from .api import api
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", api.urls),
+    path("metrics", metrics_view),
 ]
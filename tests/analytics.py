@@ -0,0 +1,181 @@
+"""
+Flakiness of testcases across testruns.
+
+Only passed and failed results count as executions. A flip is a result that
+differs from the previous execution of the same testcase, in the order the
+runs were created. Pass rate, flips and the last failure are aggregated by
+the database in one query with a window function, so sorting and paginating
+over all testcases never loads their results. The last statuses are read for
+the testcases of the returned page only.
+"""
+from typing import Dict, List, Optional, Tuple
+
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Project, TestCase, TestResult, TestRun
+
+SORT_COLUMNS = {
+    "flips": "flips",
+    "pass_rate": "pass_rate",
+    "executions": "executions",
+    "last_failed_at": "last_failed_at",
+    "case_id": "testcase.case_id",
+}
+
+CASES = TestCase._meta.db_table
+PROJECTS = Project._meta.db_table
+RESULTS = TestResult._meta.db_table
+RUNS = TestRun._meta.db_table
+
+
+def _filters(
+    project: Optional[str], environment: Optional[str]
+) -> Tuple[List[str], list]:
+    conditions, params = [], []
+    if project:
+        conditions.append(
+            f"run.project_id IN (SELECT id FROM {PROJECTS} WHERE slug = %s)"
+        )
+        params.append(project)
+    if environment:
+        conditions.append("run.environment = %s")
+        params.append(environment)
+    return conditions, params
+
+
+def _order_by(sort: str) -> str:
+    descending = sort.startswith("-")
+    column = SORT_COLUMNS[sort.lstrip("-")]
+    direction = "DESC" if descending else "ASC"
+    # NULLs (never failed) last in both directions, on every database
+    return (
+        f"CASE WHEN {column} IS NULL THEN 1 ELSE 0 END, "
+        f"{column} {direction}, stats.test_case_id {direction}"
+    )
+
+
+def flakiness(
+    project: Optional[str] = None,
+    environment: Optional[str] = None,
+    sort: str = "-flips",
+    last: int = 10,
+    limit: int = 100,
+    offset: int = 0,
+) -> Dict:
+    conditions, params = _filters(project, environment)
+    # literal values, like the condition of the partial index on executions
+    executed = f"('{TestResult.Status.PASSED}', '{TestResult.Status.FAILED}')"
+    where = " AND ".join([f"result.status IN {executed}"] + conditions)
+    executions = f"""
+        SELECT
+            result.test_case_id,
+            result.status,
+            result.updated_at,
+            LAG(result.status) OVER (
+                PARTITION BY result.test_case_id ORDER BY run.created_at, run.id
+            ) AS previous
+        FROM {RESULTS} result JOIN {RUNS} run ON run.id = result.test_run_id
+        WHERE {where}
+    """
+    stats = f"""
+        SELECT
+            test_case_id,
+            COUNT(*) AS executions,
+            1.0 * SUM(CASE WHEN status = '{TestResult.Status.PASSED}' THEN 1 ELSE 0 END)
+                / COUNT(*) AS pass_rate,
+            SUM(CASE WHEN previous <> status THEN 1 ELSE 0 END) AS flips,
+            MAX(CASE WHEN status = '{TestResult.Status.FAILED}' THEN updated_at END)
+                AS last_failed_at
+        FROM ({executions}) executions
+        GROUP BY test_case_id
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM ({stats}) stats", params)
+        count = cursor.fetchone()[0]
+        # the case id to sort by is joined, not part of the stats
+        cursor.execute(
+            f"SELECT stats.* FROM ({stats}) stats "
+            f"JOIN {CASES} testcase ON testcase.id = stats.test_case_id "
+            f"ORDER BY {_order_by(sort)} LIMIT %s OFFSET %s",
+            [*params, limit, offset],
+        )
+        rows = cursor.fetchall()
+
+    case_ids = [row[0] for row in rows]
+    return {
+        "items": _items(
+            rows,
+            _recent_statuses(case_ids, conditions, params, last),
+            TestResult.objects.filter(
+                **({"test_run__project__slug": project} if project else {}),
+                **({"test_run__environment": environment} if environment else {}),
+            ),
+        ),
+        "count": count,
+    }
+
+
+def _recent_statuses(
+    case_ids: List[int], conditions: List[str], params: list, last: int
+) -> Dict[int, List[str]]:
+    if not case_ids:
+        return {}
+    placeholders = ", ".join(["%s"] * len(case_ids))
+    where = " AND ".join([f"result.test_case_id IN ({placeholders})"] + conditions)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT test_case_id, status FROM (
+                SELECT
+                    result.test_case_id,
+                    result.status,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY result.test_case_id
+                        ORDER BY run.created_at DESC, run.id DESC
+                    ) AS position
+                FROM {RESULTS} result JOIN {RUNS} run ON run.id = result.test_run_id
+                WHERE {where}
+            ) recent
+            WHERE position <= %s
+            ORDER BY test_case_id, position
+            """,
+            [*case_ids, *params, last],
+        )
+        statuses = {}
+        for case_id, status in cursor.fetchall():
+            statuses.setdefault(case_id, []).append(status)
+    return statuses
+
+
+def _items(rows: list, statuses: Dict[int, List[str]], results) -> List[Dict]:
+    case_ids = [row[0] for row in rows]
+    testcases = TestCase.objects.in_bulk(case_ids)
+    # typed datetimes from the ORM, raw SQLite rows return them as text
+    last_failures = dict(
+        results.filter(test_case_id__in=case_ids, status=TestResult.Status.FAILED)
+        .values("test_case_id")
+        .annotate(last=Max("updated_at"))
+        .values_list("test_case_id", "last")
+    )
+    now = timezone.now()
+    items = []
+    for case_id, executions, pass_rate, flips, last_failed_at in rows:
+        last_failed_at = last_failures.get(case_id) if last_failed_at else None
+        items.append(
+            {
+                "id": case_id,
+                "case_id": testcases[case_id].case_id,
+                "title": testcases[case_id].title,
+                "executions": executions,
+                "pass_rate": float(pass_rate),
+                "flips": flips,
+                "last_statuses": statuses.get(case_id, []),
+                "last_failed_at": last_failed_at,
+                "seconds_since_failure": (now - last_failed_at).total_seconds()
+                if last_failed_at
+                else None,
+            }
+        )
+    return items
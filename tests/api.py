@@ -1,13 +1,38 @@
+import json
 from typing import List
+from xml.etree.ElementTree import ParseError
 
-from django.db import IntegrityError
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.db.models import Q, Value, IntegerField
+from django.views.decorators.http import condition
+from django.db.models import F, Q, Value, IntegerField
 
-from ninja import Router
-from ninja.pagination import paginate
+from ninja import File, Query, Router
+from ninja.files import UploadedFile
+from ninja.pagination import LimitOffsetPagination, paginate
 from ninja.errors import ValidationError
 
+from . import queries
+from .analytics import SORT_COLUMNS, flakiness
+from .cache import cached_response, get_version
+from .changes import InvalidCursor, changes_since
+from .events import event_stream
+from .export import (
+    CONTENT_TYPES,
+    TESTCASE_FORMATS,
+    TESTRUN_FORMATS,
+    Export,
+    export_testcases,
+    export_testrun,
+)
+from .pagination import KeysetPagination
+from .reports import PARSERS, import_report
+from .results import delete_results, insert_results, record_results
+from .search import get_search_backend
 from .models import TestCase, TestRun, TestResult, Project, Section
 from .schema import *
 
@@ -15,6 +40,8 @@ project_router = Router()
 section_router = Router()
 testcase_router = Router()
 testrun_router = Router()
+changes_router = Router()
+async_router = Router()
 
 
 """
@@ -22,12 +49,14 @@ Project
 """
 # project list
 @project_router.get("", response=List[ProjectOut])
+@cached_response(List[ProjectOut], lambda: ["projects"])
 def project_list(request):
     return Project.objects.all()
 
 
 # project detail
 @project_router.get("{project_id}/", response=ProjectOut)
+@cached_response(ProjectOut, lambda project_id: ["projects"])
 def project_detail(request, project_id: int):
     return get_object_or_404(Project, id=project_id)
 
@@ -66,14 +95,25 @@ Section
 """
 # section list
 @section_router.get("", response=List[SectionOut])
+@paginate(KeysetPagination)
 def section_list(request):
-    return Section.objects.all()
+    return Section.objects.with_section_hierachy()
+
+
+def section_tree_etag(request):
+    return f'"section-tree-{get_version("sections")}"'
 
 
 # section tree
 @section_router.get("tree/", response=List[SectionTreeOut])
+@condition(etag_func=section_tree_etag)
 def section_tree(request):
-    return Section.objects.filter(parent=None)
+    key = f"section-tree:{get_version('sections')}"
+    tree = cache.get(key)
+    if tree is None:
+        tree = json.dumps(queries.section_tree()).encode()
+        cache.set(key, tree)
+    return HttpResponse(tree, content_type="application/json")
 
 
 # section detail
@@ -107,6 +147,8 @@ def section_update(request, section_id: int, data: SectionPatch):
         raise ValidationError(
             ["A Section with that name already exists in that parent!"]
         )
+    except ValueError as error:
+        raise ValidationError([str(error)])
     return section
 
 
@@ -122,29 +164,66 @@ Testcases
 """
 # testcase list
 @testcase_router.get("", response=List[TestCaseOut])
-@paginate()
+@paginate(KeysetPagination)
 def testcases_list(request):
-    return TestCase.objects.all()
+    return TestCase.objects.with_section_hierachy()
 
 
 # testcases by id
 @testcase_router.post("by_id/", response=List[TestCaseOut])
-@paginate()
+@paginate(KeysetPagination)
 def testcases_by_id(request, testcase_ids: List[int]):
-    return TestCase.objects.filter(id__in=testcase_ids)
+    return TestCase.objects.filter(id__in=testcase_ids).with_section_hierachy()
 
 
 # testcases search
 @testcase_router.post("search/", response=List[TestCaseOut])
+@paginate()
 def testcases_search(request, query: str):
-    # TODO: when using postgres use this search! Or even better, look at django search docs
-    # testcases = TestCase.objects.filter(title__unaccent__lower__trigram_similar=query)
-    testcases = TestCase.objects.filter(
-        Q(title__icontains=query)
-        | Q(section__name__icontains=query)
-        | Q(case_id__icontains=query)
+    return get_search_backend().search(query).with_section_hierachy()
+
+
+def export_response(
+    request, export: Export, format: str, filename: str
+) -> StreamingHttpResponse:
+    # under ASGI the rows are read through sync_to_async, not on the event loop
+    content = aiter(export) if isinstance(request, ASGIRequest) else iter(export)
+    extension = "xml" if format == "junit" else format
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[format])
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{extension}"'
+    return response
+
+
+# testcases export as csv or ndjson
+@testcase_router.get("export/")
+def testcases_export(request, format: str = "csv"):
+    if format not in TESTCASE_FORMATS:
+        raise ValidationError(
+            [f"Export format must be one of {', '.join(TESTCASE_FORMATS)}!"]
+        )
+    return export_response(request, export_testcases(format), format, "testcases")
+
+
+# flakiness of testcases across testruns
+@testcase_router.get("flakiness/", response=FlakinessPageOut)
+def testcases_flakiness(
+    request,
+    project: str = None,
+    environment: TestRun.Environment = None,
+    sort: str = "-flips",
+    last: int = Query(10, ge=1, le=100),
+    pagination: LimitOffsetPagination.Input = Query(...),
+):
+    if sort.lstrip("-") not in SORT_COLUMNS:
+        raise ValidationError([f"Sort must be one of {', '.join(SORT_COLUMNS)}!"])
+    return flakiness(
+        project,
+        environment,
+        sort,
+        last,
+        limit=pagination.limit,
+        offset=pagination.offset,
     )
-    return testcases
 
 
 # testcase detail
@@ -153,14 +232,16 @@ def testcase_detail(request, case_id: int):
     return get_object_or_404(TestCase, id=case_id)
 
 
+# testcases by section, including all subsections up to `depth` levels below
 @testcase_router.get("section/{section_id}/", response=List[TestCaseOut])
-def testcases_by_section(request, section_id: int):
+@paginate()
+def testcases_by_section(request, section_id: int, depth: int = None):
     section = get_object_or_404(Section, id=section_id)
-    testcases = []
-    for testcases_queryset in section.all_child_testcases:
-        for testcase in testcases_queryset:
-            testcases.append(testcase)
-    return testcases
+    return (
+        TestCase.objects.filter(section__in=Section.objects.subtree(section, depth))
+        .with_section_hierachy()
+        .order_by("section__path", "id")
+    )
 
 
 # testcase create
@@ -199,21 +280,86 @@ Testruns
 """
 # testrun list
 @testrun_router.get("", response=List[TestRunOut])
+@paginate(KeysetPagination, ordering=("-created_at", "-id"))
 def testrun_list(request):
-    testruns = TestRun.objects.all()
+    testruns = queries.testruns()
     return testruns
 
 
+# testrun summaries
+@testrun_router.get("summary/", response=List[TestRunSummaryOut])
+@paginate(KeysetPagination, ordering=("-created_at", "-id"))
+def testrun_summary_list(request, filters: TestRunFilter = Query(...)):
+    return filters.filter(queries.testrun_summaries())
+
+
+# a testrun response contains its project, results, testcases and sections
+def testrun_versions(run_id: int) -> List[str]:
+    return ["projects", "testcases", "sections", f"testrun:{run_id}"]
+
+
+def project_testrun_versions(project_slug: str) -> List[str]:
+    run_ids = TestRun.objects.filter(project__slug=project_slug).values_list(
+        "id", flat=True
+    )
+    return ["projects", "testcases", "sections", *(f"testrun:{pk}" for pk in run_ids)]
+
+
 # testrun detail
 @testrun_router.get("{run_id}/", response=TestRunOut)
+@cached_response(TestRunOut, testrun_versions)
 def testrun_detail(request, run_id: int):
-    return get_object_or_404(TestRun, id=run_id)
+    return get_object_or_404(queries.testruns(), id=run_id)
 
 
 # testruns by project
 @testrun_router.get("project/{project_slug}/", response=List[TestRunOut])
+@cached_response(List[TestRunOut], project_testrun_versions)
 def testrun_by_project(request, project_slug: str):
-    return get_object_or_404(Project, slug=project_slug).testruns
+    project = get_object_or_404(Project, slug=project_slug)
+    return queries.testruns(project.testruns.all())
+
+
+# testrun summaries by project
+@testrun_router.get("project/{project_slug}/summary/", response=List[TestRunSummaryOut])
+@paginate(KeysetPagination, ordering=("-created_at", "-id"))
+def testrun_summary_by_project(
+    request, project_slug: str, filters: TestRunFilter = Query(...)
+):
+    project = get_object_or_404(Project, slug=project_slug)
+    return filters.filter(queries.testrun_summaries(project.testruns.all()))
+
+
+# testrun result changes as server-sent events, fetch the detail once and
+# apply these instead of polling it; only served under ASGI, with WSGI every
+# open stream would hold a worker thread
+@testrun_router.get("{run_id}/events/")
+async def testrun_events(request, run_id: int):
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {"detail": "Event streams need the ASGI server, poll instead."},
+            status=501,
+        )
+    await aget_object_or_404(TestRun.objects.all(), id=run_id)
+    response = StreamingHttpResponse(
+        event_stream(run_id), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+# testrun export as csv, ndjson or junit xml
+@testrun_router.get("{run_id}/export/")
+def testrun_export(request, run_id: int, format: str = "csv"):
+    testrun = get_object_or_404(TestRun, id=run_id)
+    if format not in TESTRUN_FORMATS:
+        raise ValidationError(
+            [f"Export format must be one of {', '.join(TESTRUN_FORMATS)}!"]
+        )
+    return export_response(
+        request, export_testrun(testrun, format), format, f"testrun-{testrun.pk}"
+    )
 
 
 # testrun create
@@ -223,17 +369,82 @@ def testrun_create(request, data: TestRunIn):
     return testrun
 
 
-# testrun add testresults
-@testrun_router.patch("{run_id}/add-cases/", response=TestRunOut)
+# testrun add testresults, cases already in the run are left as they are
+@testrun_router.patch("{run_id}/add-cases/", response=TestRunAddCasesOut)
 def testrun_add_cases(request, run_id: int, case_id_list: List[int]):
+    get_object_or_404(TestRun, id=run_id)
+    known = set(
+        TestCase.objects.filter(id__in=case_id_list).values_list("id", flat=True)
+    )
+    present = set(
+        TestResult.objects.filter(
+            test_run_id=run_id, test_case_id__in=known
+        ).values_list("test_case_id", flat=True)
+    )
+    added = known - present
+    if added:
+        # conflicts with concurrent requests are skipped by the database
+        insert_results(run_id, TestCase.objects.filter(id__in=added), "id")
+    return {
+        "added": sorted(added),
+        "present": sorted(present),
+        "unknown": sorted(set(case_id_list) - known),
+    }
+
+
+# testrun clone with all or only some results, e.g. to rerun the failed ones
+@testrun_router.post("{run_id}/clone/", response=TestRunSummaryOut)
+def testrun_clone(request, run_id: int, data: TestRunCloneIn):
     testrun = get_object_or_404(TestRun, id=run_id)
-    testcases = TestCase.objects.in_bulk(case_id_list)
-    testresults = [
-        TestResult(test_run_id=run_id, test_case_id=value.id)
-        for value in testcases.values()
-    ]
-    TestResult.objects.bulk_create(testresults)
-    return testrun
+    results = TestResult.objects.filter(test_run_id=run_id)
+    if data.statuses:
+        results = results.filter(status__in=data.statuses)
+    with transaction.atomic():
+        clone = TestRun.objects.create(
+            project_id=testrun.project_id,
+            title=data.title or testrun.title,
+            description=testrun.description
+            if data.description is None
+            else data.description,
+            environment=data.environment or testrun.environment,
+        )
+        insert_results(clone.id, results, "test_case_id", priority=F("priority"))
+    return queries.testrun_summaries().get(id=clone.id)
+
+
+# testrun add all testcases of a section subtree
+@testrun_router.patch("{run_id}/add-section/{section_id}/", response=TestRunSummaryOut)
+def testrun_add_section(request, run_id: int, section_id: int, depth: int = None):
+    get_object_or_404(TestRun, id=run_id)
+    section = get_object_or_404(Section, id=section_id)
+    testcases = TestCase.objects.filter(
+        section__in=Section.objects.subtree(section, depth)
+    )
+    insert_results(run_id, testcases, "id")
+    return queries.testrun_summaries().get(id=run_id)
+
+
+# testrun record results
+@testrun_router.patch("{run_id}/results/", response=List[TestResultOutcomeOut])
+def testrun_record_results(request, run_id: int, results: List[TestResultIn]):
+    get_object_or_404(TestRun, id=run_id)
+    outcomes = record_results(run_id, (result.dict() for result in results))
+    return [{"case_id": case_id, "outcome": outcome} for case_id, outcome in outcomes]
+
+
+# testrun import junit xml or json lines report
+@testrun_router.post("{run_id}/report/", response=ReportImportOut)
+def testrun_import_report(
+    request, run_id: int, format: str = "junit", report: UploadedFile = File(...)
+):
+    get_object_or_404(TestRun, id=run_id)
+    if format not in PARSERS:
+        raise ValidationError([f"Report format must be one of {', '.join(PARSERS)}!"])
+    try:
+        return import_report(run_id, report, format)
+    except (ParseError, ValueError) as error:
+        # batches before the broken part of the report are already written
+        raise ValidationError([f"Could not parse report: {error}"])
 
 
 # testrun remove testresults
@@ -242,9 +453,7 @@ def testrun_remove_cases(request, run_id: int, case_id_list: List[int]):
     testresults = TestResult.objects.filter(
         test_run_id=run_id, test_case_id__in=case_id_list
     )
-    removed_ids = list(testresults.values_list("id", flat=True))
-    testresults.delete()
-    return removed_ids
+    return delete_results(testresults)
 
 
 # testrun delete
@@ -252,3 +461,123 @@ def testrun_remove_cases(request, run_id: int, case_id_list: List[int]):
 def testrun_delete(request, run_id: int):
     get_object_or_404(TestRun, id=run_id).delete()
     return {"success": True}
+
+
+"""
+Changes
+"""
+# changes since cursor
+@changes_router.get("", response=ChangesOut)
+def changes(request, cursor: str = None, limit: int = Query(500, ge=1, le=5000)):
+    try:
+        return changes_since(cursor, limit)
+    except InvalidCursor:
+        raise ValidationError(["Invalid changes cursor!"])
+
+
+"""
+Async
+"""
+# read endpoints for dashboards polling under ASGI, they hold no thread while
+# waiting for the database. Lazy relations can not be loaded in async code,
+# so everything the schemas read is fetched up front.
+async def aget_object_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404
+
+
+# async project list
+@async_router.get("projects/", response=List[ProjectOut])
+async def async_project_list(request):
+    return [project async for project in Project.objects.all().aiterator()]
+
+
+# async project detail
+@async_router.get("projects/{project_id}/", response=ProjectOut)
+async def async_project_detail(request, project_id: int):
+    return await aget_object_or_404(Project.objects.all(), id=project_id)
+
+
+# async section list
+@async_router.get("sections/", response=SectionPageOut)
+async def async_section_list(request, pagination: KeysetPagination.Input = Query(...)):
+    return await KeysetPagination().apaginate_queryset(
+        Section.objects.with_section_hierachy(), pagination
+    )
+
+
+# async section detail
+@async_router.get("sections/{section_id}/", response=SectionOut)
+async def async_section_detail(request, section_id: int):
+    return await aget_object_or_404(
+        Section.objects.with_section_hierachy(), id=section_id
+    )
+
+
+# async testcase list
+@async_router.get("testcases/", response=TestCasePageOut)
+async def async_testcases_list(
+    request, pagination: KeysetPagination.Input = Query(...)
+):
+    return await KeysetPagination().apaginate_queryset(
+        TestCase.objects.with_section_hierachy(), pagination
+    )
+
+
+# async testcases search
+@async_router.post("testcases/search/", response=TestCasePageOut)
+async def async_testcases_search(
+    request, query: str, pagination: LimitOffsetPagination.Input = Query(...)
+):
+    backend = await sync_to_async(get_search_backend)()
+    testcases = backend.search(query).with_section_hierachy()
+    page = testcases[pagination.offset : pagination.offset + pagination.limit]
+    return {
+        "items": [testcase async for testcase in page.aiterator()],
+        "count": await testcases.acount(),
+    }
+
+
+# async testcase detail
+@async_router.get("testcases/{case_id}/", response=TestCaseOut)
+async def async_testcase_detail(request, case_id: int):
+    return await aget_object_or_404(
+        TestCase.objects.with_section_hierachy(), id=case_id
+    )
+
+
+# async testrun summaries
+@async_router.get("testruns/summary/", response=TestRunSummaryPageOut)
+async def async_testrun_summary_list(
+    request,
+    filters: TestRunFilter = Query(...),
+    pagination: KeysetPagination.Input = Query(...),
+):
+    return await KeysetPagination(ordering=("-created_at", "-id")).apaginate_queryset(
+        filters.filter(queries.testrun_summaries()), pagination
+    )
+
+
+# async testrun detail
+@async_router.get("testruns/{run_id}/", response=TestRunOut)
+async def async_testrun_detail(request, run_id: int):
+    return await aget_object_or_404(queries.testruns(), id=run_id)
+
+
+# async testrun summary
+@async_router.get("testruns/{run_id}/summary/", response=TestRunSummaryOut)
+async def async_testrun_summary(request, run_id: int):
+    return await aget_object_or_404(queries.testrun_summaries(), id=run_id)
+
+
+# async changes since cursor
+@async_router.get("changes/", response=ChangesOut)
+async def async_changes(
+    request, cursor: str = None, limit: int = Query(500, ge=1, le=5000)
+):
+    try:
+        return await sync_to_async(changes_since)(cursor, limit)
+    except InvalidCursor:
+        raise ValidationError(["Invalid changes cursor!"])
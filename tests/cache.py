@@ -0,0 +1,121 @@
+"""
+Versioned cache keys.
+
+A version is a counter in the cache that is bumped whenever the data it stands
+for changes. Entries are cached under keys containing the current version, so
+a bump invalidates all of them at once without having to find and delete them.
+
+`cached_response` caches the serialized response of an endpoint under the
+versions of everything the response is built from.
+"""
+import hashlib
+import json
+import time
+from collections import Counter
+from functools import wraps
+from threading import Lock
+from typing import Any, Callable, Dict, Iterable, List
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import QuerySet
+from django.http import HttpResponse
+from ninja.responses import NinjaJSONEncoder
+from pydantic import parse_obj_as
+
+
+def _version_key(name: str) -> str:
+    return f"version:{name}"
+
+
+def get_version(name: str) -> int:
+    version = cache.get(_version_key(name))
+    if version is None:
+        # start from the clock, so a version evicted from the cache never
+        # comes back with a number that old entries were cached under
+        cache.add(_version_key(name), time.time_ns() // 1000, timeout=None)
+        version = cache.get(_version_key(name))
+    return version
+
+
+def bump_version(name: str) -> None:
+    try:
+        cache.incr(_version_key(name))
+    except ValueError:
+        get_version(name)
+
+
+def get_versions(names: Iterable[str]) -> Dict[str, int]:
+    names = list(names)
+    versions = cache.get_many([_version_key(name) for name in names])
+    return {
+        name: versions.get(_version_key(name)) or get_version(name) for name in names
+    }
+
+
+def invalidate(*names: str) -> None:
+    """
+    Bump versions now, for reads later in the same transaction, and again on
+    commit, in case another request cached the old data in between.
+    """
+    for name in names:
+        bump_version(name)
+    transaction.on_commit(lambda: [bump_version(name) for name in names])
+
+
+class CacheStats:
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def record(self, endpoint: str, hit: bool) -> None:
+        with self.lock:
+            (self.hits if hit else self.misses)[endpoint] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self.lock:
+            return {
+                endpoint: {"hits": self.hits[endpoint], "misses": self.misses[endpoint]}
+                for endpoint in self.hits.keys() | self.misses.keys()
+            }
+
+
+stats = CacheStats()
+
+
+def cached_response(response: Any, versions: Callable[..., List[str]]):
+    """
+    Cache the JSON of an endpoint returning `response`. `versions` gets the
+    arguments of the endpoint and returns the names of the versions its
+    response depends on. Entries expire and are evicted like any other entry
+    of the default cache, responses larger than CACHE_MAX_ENTRY_SIZE bytes
+    are not cached.
+    """
+
+    def decorator(func):
+        endpoint = func.__name__
+
+        @wraps(func)
+        def view(request, **kwargs):
+            arguments = json.dumps(kwargs, sort_keys=True, default=str)
+            current = json.dumps(get_versions(versions(**kwargs)), sort_keys=True)
+            digest = hashlib.sha1(f"{arguments}:{current}".encode()).hexdigest()
+            key = f"response:{endpoint}:{digest}"
+
+            content = cache.get(key)
+            stats.record(endpoint, hit=content is not None)
+            if content is None:
+                result = func(request, **kwargs)
+                if isinstance(result, QuerySet):
+                    result = list(result)
+                data = parse_obj_as(response, result)
+                content = json.dumps(data, cls=NinjaJSONEncoder).encode()
+                if len(content) <= getattr(settings, "CACHE_MAX_ENTRY_SIZE", 1 << 20):
+                    cache.set(key, content)
+            return HttpResponse(content, content_type="application/json")
+
+        return view
+
+    return decorator
@@ -0,0 +1,203 @@
+"""
+Testrun events for the server-sent events endpoint.
+
+Writes publish compact deltas of the results of a run to the `hub`, once
+their transaction is committed. Every open event stream holds a subscription
+to its run. Without the `EVENT_BROKER` setting, events only reach the streams
+of the same process. With it, they are sent to the broker started by the
+`event_broker` command, which passes them on to every connected process.
+
+Streams are async generators waiting on an asyncio queue, so an open stream
+costs no thread under ASGI. Events are published from threads (requests,
+on_commit callbacks, the broker connection) and handed over to the event
+loop of the stream with `call_soon_threadsafe`.
+"""
+import asyncio
+import json
+import logging
+import socket
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# seconds until a stream sends a comment to keep the connection open, and
+# until it ends and lets the client reconnect
+KEEPALIVE = 15
+STREAM_TIMEOUT = 300
+BROKER_RETRY = 5
+
+
+class Subscription:
+    def __init__(
+        self, hub: "Hub", run_id: int, loop: asyncio.AbstractEventLoop
+    ) -> None:
+        self.hub = hub
+        self.run_id = run_id
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def put(self, event: Dict[str, Any]) -> None:
+        """Hand an event over to the loop of the stream, from any thread."""
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except RuntimeError:
+            # the loop is closed, its stream is gone
+            pass
+
+    async def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        self.hub.unsubscribe(self)
+
+
+class Hub:
+    def __init__(self, broker: Optional[str] = None) -> None:
+        self.lock = threading.Lock()
+        self.subscriptions: Dict[int, Set[Subscription]] = {}
+        self.broker = BrokerClient(broker, self.deliver) if broker else None
+
+    def subscribe(self, run_id: int, loop: asyncio.AbstractEventLoop) -> Subscription:
+        if self.broker is not None:
+            # a process that only streams has to be connected to receive events
+            self.broker.connect()
+        subscription = Subscription(self, run_id, loop)
+        with self.lock:
+            self.subscriptions.setdefault(run_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.run_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscriptions.pop(subscription.run_id, None)
+
+    def publish(self, run_id: int, event: Dict[str, Any]) -> None:
+        # the broker sends events back to this process as well
+        if self.broker is None or not self.broker.send(run_id, event):
+            self.deliver(run_id, event)
+
+    def deliver(self, run_id: int, event: Dict[str, Any]) -> None:
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(run_id, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+
+
+class BrokerClient:
+    """
+    Connection to the `event_broker` command, a stand-in for a message broker
+    on a single machine. Messages are lines of JSON in both directions.
+    While the broker is unreachable, events are delivered in-process only.
+    """
+
+    def __init__(self, address: str, deliver) -> None:
+        host, port = address.rsplit(":", 1)
+        self.address = (host, int(port))
+        self.deliver = deliver
+        self.lock = threading.Lock()
+        self.socket: Optional[socket.socket] = None
+        self.failed_at = 0.0
+
+    def send(self, run_id: int, event: Dict[str, Any]) -> bool:
+        line = json.dumps({"run": run_id, "event": event}).encode() + b"\n"
+        with self.lock:
+            if not self._connect():
+                return False
+            try:
+                self.socket.sendall(line)
+                return True
+            except OSError:
+                self._disconnect()
+                return False
+
+    def connect(self) -> bool:
+        with self.lock:
+            return self._connect()
+
+    def _connect(self) -> bool:
+        if self.socket is not None:
+            return True
+        if time.monotonic() - self.failed_at < BROKER_RETRY:
+            return False
+        try:
+            self.socket = socket.create_connection(self.address, timeout=1)
+            self.socket.settimeout(None)
+        except OSError as error:
+            self.failed_at = time.monotonic()
+            logger.warning("event broker %s unreachable: %s", self.address, error)
+            return False
+        threading.Thread(target=self._receive, args=(self.socket,), daemon=True).start()
+        return True
+
+    def _disconnect(self) -> None:
+        if self.socket is not None:
+            self.socket.close()
+        self.socket = None
+        self.failed_at = time.monotonic()
+
+    def _receive(self, connection: socket.socket) -> None:
+        try:
+            for line in connection.makefile("rb"):
+                message = json.loads(line)
+                self.deliver(message["run"], message["event"])
+        except (OSError, ValueError):
+            pass
+        with self.lock:
+            if self.socket is connection:
+                self._disconnect()
+
+
+hub = Hub(getattr(settings, "EVENT_BROKER", None))
+
+
+def publish_on_commit(run_id: int, event: Dict[str, Any]) -> None:
+    transaction.on_commit(lambda: hub.publish(run_id, event))
+
+
+def publish_status(run_id: int, results: List[tuple]) -> None:
+    """Publish the new `(id, status, priority)` of changed results of a run."""
+    if results:
+        publish_on_commit(run_id, {"type": "status", "results": results})
+
+
+def publish_added(run_id: int, count: int) -> None:
+    if count:
+        publish_on_commit(run_id, {"type": "added", "count": count})
+
+
+async def event_stream(run_id: int) -> AsyncIterator[str]:
+    """Server-sent events of a run, until it is deleted."""
+    keepalive = getattr(settings, "EVENT_KEEPALIVE", KEEPALIVE)
+    deadline = time.monotonic() + getattr(
+        settings, "EVENT_STREAM_TIMEOUT", STREAM_TIMEOUT
+    )
+    # subscribe when the stream starts, so an unsent response leaks nothing;
+    # in a thread, connecting to the broker blocks
+    subscription = await sync_to_async(hub.subscribe, thread_sensitive=False)(
+        run_id, asyncio.get_running_loop()
+    )
+    try:
+        yield "retry: 2000\n\n"
+        while time.monotonic() < deadline:
+            event = await subscription.get(
+                timeout=min(keepalive, max(deadline - time.monotonic(), 0))
+            )
+            if event is None:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            if event["type"] == "deleted":
+                return
+    finally:
+        subscription.close()
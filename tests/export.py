@@ -0,0 +1,246 @@
+"""
+Streaming exports of testcases and testruns.
+
+Rows are read in chunks of `CHUNK_SIZE`, each chunk a keyset query on the id,
+and written as they arrive, so an export needs the same memory for ten rows
+as for a million, and the first bytes are sent right after the first chunk is
+read. An `Export` is iterated synchronously under WSGI and by the management
+command, asynchronously under ASGI, where the chunks are read in the database
+thread through `sync_to_async`. Only the names of all sections are loaded up
+front, to write the section hierachy of every row.
+"""
+import csv
+import json
+from typing import AsyncIterator, Callable, Dict, Iterator, List
+from xml.sax.saxutils import quoteattr
+
+from asgiref.sync import sync_to_async
+from django.db.models import QuerySet
+
+from . import stats
+from .models import Section, TestCase, TestResult, TestRun, TestRunStats
+
+CHUNK_SIZE = 2000
+
+TESTCASE_FIELDS = (
+    "id",
+    "case_id",
+    "title",
+    "section",
+    "is_automation",
+    "type",
+    "expected_result",
+    "preconditions",
+    "created_at",
+    "updated_at",
+)
+RESULT_FIELDS = (
+    "id",
+    "case_id",
+    "title",
+    "section",
+    "status",
+    "priority",
+    "details",
+    "updated_at",
+)
+
+CONTENT_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "junit": "application/xml",
+}
+TESTCASE_FORMATS = ("csv", "ndjson")
+TESTRUN_FORMATS = ("csv", "ndjson", "junit")
+
+
+class SectionNames:
+    """Section hierachies from materialized paths, in the format of the API."""
+
+    def __init__(self) -> None:
+        self.names = dict(Section.objects.values_list("id", "name"))
+
+    def hierachy(self, path: str) -> str:
+        if not path:
+            return ""
+        names = (self.names.get(int(pk), "") for pk in path.strip("/").split("/"))
+        return f"/{'/'.join(names)}"
+
+
+class Echo:
+    """File-like object returning what is written, for csv.writer."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+class Rows:
+    """
+    Rows of a `values_list` queryset ordered by id, as dicts with the keys
+    `fields`, in chunks read one query at a time.
+    """
+
+    def __init__(
+        self,
+        queryset: QuerySet,
+        fields: List[str],
+        section_names: SectionNames,
+    ) -> None:
+        self.queryset = queryset
+        self.fields = fields
+        self.section_names = section_names
+
+    def fetch(self, after: int) -> List[Dict]:
+        rows = []
+        for *values, path in self.queryset.filter(id__gt=after)[:CHUNK_SIZE]:
+            row = dict(zip(self.fields, values))
+            row["section"] = self.section_names.hierachy(path)
+            rows.append(row)
+        return rows
+
+    def __iter__(self) -> Iterator[List[Dict]]:
+        chunk = self.fetch(0)
+        while chunk:
+            yield chunk
+            chunk = self.fetch(chunk[-1]["id"])
+
+    async def __aiter__(self) -> AsyncIterator[List[Dict]]:
+        fetch = sync_to_async(self.fetch)
+        chunk = await fetch(0)
+        while chunk:
+            yield chunk
+            chunk = await fetch(chunk[-1]["id"])
+
+
+class Export:
+    """`head`, a `line` for every row and `tail`, one write per chunk of rows."""
+
+    def __init__(
+        self, rows: Rows, line: Callable[[Dict], str], head: str = "", tail: str = ""
+    ) -> None:
+        self.rows = rows
+        self.line = line
+        self.head = head
+        self.tail = tail
+
+    def __iter__(self) -> Iterator[str]:
+        yield self.head
+        for chunk in self.rows:
+            yield "".join(map(self.line, chunk))
+        yield self.tail
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        yield self.head
+        async for chunk in self.rows:
+            yield "".join(map(self.line, chunk))
+        yield self.tail
+
+
+def testcase_rows(section_names: SectionNames) -> Rows:
+    fields = [field for field in TESTCASE_FIELDS if field != "section"]
+    queryset = TestCase.objects.order_by("id").values_list(*fields, "section__path")
+    return Rows(queryset, fields, section_names)
+
+
+def result_rows(run_id: int, section_names: SectionNames) -> Rows:
+    lookups = {
+        "id": "id",
+        "case_id": "test_case__case_id",
+        "title": "test_case__title",
+        "status": "status",
+        "priority": "priority",
+        "details": "details",
+        "updated_at": "updated_at",
+    }
+    queryset = (
+        TestResult.objects.filter(test_run_id=run_id)
+        .order_by("id")
+        .values_list(*lookups.values(), "test_case__section__path")
+    )
+    return Rows(queryset, list(lookups), section_names)
+
+
+def _isoformat(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def to_csv(rows: Rows, fields: List[str]) -> Export:
+    writer = csv.writer(Echo())
+    return Export(
+        rows,
+        lambda row: writer.writerow([_isoformat(row[field]) for field in fields]),
+        head=writer.writerow(fields),
+    )
+
+
+def to_ndjson(rows: Rows) -> Export:
+    return Export(
+        rows,
+        lambda row: json.dumps({key: _isoformat(value) for key, value in row.items()})
+        + "\n",
+    )
+
+
+JUNIT_ELEMENTS = {
+    TestResult.Status.FAILED: "failure",
+    TestResult.Status.SKIPPED: "skipped",
+    TestResult.Status.UNTESTED: "skipped",
+    TestResult.Status.RETEST: "skipped",
+}
+
+
+def to_junit(testrun: TestRun, rows: Rows) -> Export:
+    """
+    A JUnit XML report that import_report reads back, with the case id as
+    property of every testcase.
+    """
+    counters = (
+        TestRunStats.objects.filter(test_run=testrun).values(*stats.COUNTERS).first()
+    )
+    if counters is None:
+        # runs from bulk_create have no stats until their first change
+        counters = TestRun.objects.filter(pk=testrun.pk).aggregate(**stats.counts())
+    counts = {
+        "tests": counters["total"],
+        "failures": counters["status_failed"],
+        "skipped": counters["total"]
+        - counters["status_passed"]
+        - counters["status_failed"],
+    }
+    head = (
+        '<?xml version="1.0" encoding="utf-8"?>\n<testsuites>\n'
+        f"<testsuite name={quoteattr(testrun.title)} tests=\"{counts['tests']}\" "
+        f"failures=\"{counts['failures']}\" skipped=\"{counts['skipped']}\" "
+        f'timestamp="{testrun.created_at.isoformat()}">\n'
+    )
+
+    def testcase(row: Dict) -> str:
+        element = JUNIT_ELEMENTS.get(row["status"])
+        outcome = ""
+        if element:
+            message = row["details"] or row["status"]
+            outcome = f"<{element} message={quoteattr(message)}/>"
+        return (
+            f"<testcase classname={quoteattr(row['section'])} "
+            f"name={quoteattr(row['title'])}>"
+            f'<properties><property name="case_id" value={quoteattr(row["case_id"])}/>'
+            f"</properties>{outcome}</testcase>\n"
+        )
+
+    return Export(rows, testcase, head=head, tail="</testsuite>\n</testsuites>\n")
+
+
+def export_testcases(format: str) -> Export:
+    rows = testcase_rows(SectionNames())
+    if format == "csv":
+        return to_csv(rows, TESTCASE_FIELDS)
+    return to_ndjson(rows)
+
+
+def export_testrun(testrun: TestRun, format: str) -> Export:
+    rows = result_rows(testrun.pk, SectionNames())
+    if format == "csv":
+        return to_csv(rows, RESULT_FIELDS)
+    if format == "junit":
+        return to_junit(testrun, rows)
+    return to_ndjson(rows)
@@ -0,0 +1,394 @@
+import csv
+import json
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+from io import StringIO
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import connection, transaction
+from django.test import Client
+from django.utils import timezone
+from tests.metrics import QueryTimer
+from tests.models import Project, Section, TestCase, TestResult, TestRun
+
+
+class Upload(NamedTuple):
+    """A body sent as multipart form with a single file."""
+
+    field: str
+    name: str
+    content: bytes
+
+
+def junit_report(samples: Dict[str, Any]) -> Upload:
+    testcases = "".join(
+        f'<testcase name="{case_id}"><properties>'
+        f'<property name="case_id" value="{case_id}"/></properties></testcase>'
+        for case_id in samples["run_case_ids"]
+    )
+    report = f"<testsuites><testsuite>{testcases}</testsuite></testsuites>"
+    return Upload("report", "report.xml", report.encode())
+
+
+# name, method, path and body; paths and bodies are filled in from `samples`
+# the event stream is left out, it only ends when the client disconnects
+ENDPOINTS = [
+    ("project_list", "get", "/api/projects/", None),
+    ("project_detail", "get", "/api/projects/{project_id}/", None),
+    ("project_create", "post", "/api/projects/", lambda s: {"name": "benchmark"}),
+    (
+        "project_update",
+        "patch",
+        "/api/projects/{project_id}/",
+        lambda s: {"name": "benchmark"},
+    ),
+    ("project_delete", "delete", "/api/projects/{project_id}/", None),
+    ("section_list", "get", "/api/sections/", None),
+    ("section_tree", "get", "/api/sections/tree/", None),
+    ("section_detail", "get", "/api/sections/{section_id}/", None),
+    (
+        "section_create",
+        "post",
+        "/api/sections/",
+        lambda s: {"name": "benchmark", "parent_id": s["section_id"]},
+    ),
+    (
+        "section_update",
+        "patch",
+        "/api/sections/{leaf_section_id}/",
+        lambda s: {"parent_id": s["other_section_id"]},
+    ),
+    ("section_delete", "delete", "/api/sections/{leaf_section_id}/", None),
+    ("testcases_list", "get", "/api/testcases/", None),
+    ("testcases_by_id", "post", "/api/testcases/by_id/", lambda s: s["case_ids"]),
+    ("testcases_search", "post", "/api/testcases/search/?query={search}", None),
+    ("testcases_flakiness", "get", "/api/testcases/flakiness/", None),
+    ("testcases_export", "get", "/api/testcases/export/", None),
+    ("testcase_detail", "get", "/api/testcases/{case_id}/", None),
+    ("testcases_by_section", "get", "/api/testcases/section/{section_id}/", None),
+    (
+        "testcase_create",
+        "post",
+        "/api/testcases/",
+        lambda s: {
+            "case_id": "CBENCH",
+            "title": "benchmark",
+            "is_automation": False,
+            "section_id": s["section_id"],
+            "expected_result": "",
+            "preconditions": "",
+            "type": "smoke",
+        },
+    ),
+    (
+        "testcase_update",
+        "patch",
+        "/api/testcases/{case_id}/",
+        lambda s: {"title": "benchmark"},
+    ),
+    ("testcase_delete", "delete", "/api/testcases/{case_id}/", None),
+    ("testrun_list", "get", "/api/testruns/", None),
+    ("testrun_summary_list", "get", "/api/testruns/summary/", None),
+    ("testrun_detail", "get", "/api/testruns/{run_id}/", None),
+    ("testrun_export", "get", "/api/testruns/{run_id}/export/?format=junit", None),
+    ("testrun_by_project", "get", "/api/testruns/project/{project_slug}/", None),
+    (
+        "testrun_summary_by_project",
+        "get",
+        "/api/testruns/project/{project_slug}/summary/",
+        None,
+    ),
+    (
+        "testrun_create",
+        "post",
+        "/api/testruns/",
+        lambda s: {
+            "project_id": s["project_id"],
+            "title": "benchmark",
+            "description": "",
+            "environment": "dev",
+        },
+    ),
+    (
+        "testrun_add_cases",
+        "patch",
+        "/api/testruns/{run_id}/add-cases/",
+        lambda s: s["case_ids"],
+    ),
+    (
+        "testrun_clone",
+        "post",
+        "/api/testruns/{run_id}/clone/",
+        lambda s: {"statuses": ["failed"]},
+    ),
+    (
+        "testrun_add_section",
+        "patch",
+        "/api/testruns/{run_id}/add-section/{section_id}/",
+        None,
+    ),
+    (
+        "testrun_record_results",
+        "patch",
+        "/api/testruns/{run_id}/results/",
+        lambda s: [
+            {"case_id": case_id, "status": "passed"} for case_id in s["run_case_ids"]
+        ],
+    ),
+    ("testrun_import_report", "post", "/api/testruns/{run_id}/report/", junit_report),
+    (
+        "testrun_remove_cases",
+        "patch",
+        "/api/testruns/{run_id}/remove-cases/",
+        lambda s: s["case_ids"],
+    ),
+    ("testrun_delete", "delete", "/api/testruns/{run_id}/", None),
+    ("changes", "get", "/api/changes/", None),
+    ("async_project_list", "get", "/api/async/projects/", None),
+    ("async_project_detail", "get", "/api/async/projects/{project_id}/", None),
+    ("async_section_list", "get", "/api/async/sections/", None),
+    ("async_section_detail", "get", "/api/async/sections/{section_id}/", None),
+    ("async_testcases_list", "get", "/api/async/testcases/", None),
+    (
+        "async_testcases_search",
+        "post",
+        "/api/async/testcases/search/?query={search}",
+        None,
+    ),
+    ("async_testcase_detail", "get", "/api/async/testcases/{case_id}/", None),
+    ("async_testrun_summary_list", "get", "/api/async/testruns/summary/", None),
+    ("async_testrun_detail", "get", "/api/async/testruns/{run_id}/", None),
+    ("async_testrun_summary", "get", "/api/async/testruns/{run_id}/summary/", None),
+    ("async_changes", "get", "/api/async/changes/", None),
+]
+
+IMPORT_COLUMNS = [
+    "ID",
+    "Title",
+    "Automation required?",
+    "Expected Result",
+    "Preconditions",
+    "Section Hierarchy",
+    "Type",
+]
+
+
+def allowed_host() -> str:
+    # with DEBUG and no ALLOWED_HOSTS, Django accepts localhost
+    host = next(iter(settings.ALLOWED_HOSTS), "*")
+    return "localhost" if host == "*" else host.lstrip(".")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "time every api endpoint and import_testcases on the current database "
+        "and write the results as json, changes are rolled back and the cache "
+        "is cleared"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--import-rows",
+            type=int,
+            default=1000,
+            help="rows of the csv file imported by the import_testcases benchmark",
+        )
+        parser.add_argument("--output", default="benchmark.json")
+        parser.add_argument(
+            "--compare", help="earlier output to compare the median times with"
+        )
+        parser.add_argument("--only", nargs="+", help="names of the benchmarks to run")
+
+    def handle(self, *args: Any, **options: Any) -> Optional[str]:
+        samples = self.samples()
+        if samples is None:
+            raise CommandError("no testruns with results, run generate_data first")
+
+        self.repeat = options["repeat"]
+        self.client = Client(SERVER_NAME=allowed_host())
+        results = []
+        for name, method, path, body in ENDPOINTS:
+            if options["only"] and name not in options["only"]:
+                continue
+            results.append(
+                self.measure_endpoint(
+                    name,
+                    method,
+                    path.format(**samples),
+                    body(samples) if body else None,
+                )
+            )
+        if not options["only"] or "import_testcases" in options["only"]:
+            results.append(self.measure_import(options["import_rows"]))
+
+        report = {
+            "revision": git_revision(),
+            "created_at": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "rows": {
+                model.__name__: model.objects.count()
+                for model in (Project, Section, TestCase, TestRun, TestResult)
+            },
+            "repeat": self.repeat,
+            "results": results,
+        }
+        with open(options["output"], "w") as output:
+            json.dump(report, output, indent=2)
+
+        baseline = {}
+        if options["compare"]:
+            with open(options["compare"]) as compare:
+                baseline = {
+                    result["name"]: result for result in json.load(compare)["results"]
+                }
+        for result in results:
+            self.stdout.write(self.format_result(result, baseline.get(result["name"])))
+        self.stdout.write(self.style.SUCCESS(f"wrote {options['output']}"))
+        return
+
+    def samples(self) -> Optional[Dict[str, Any]]:
+        run = (
+            TestRun.objects.filter(testresult__isnull=False)
+            .select_related("project")
+            .order_by("id")
+            .first()
+        )
+        section = Section.objects.filter(parent=None).order_by("id").first()
+        leaf = Section.objects.order_by("-depth", "-id").first()
+        if run is None or section is None:
+            return None
+        run_case_ids = list(
+            TestResult.objects.filter(test_run=run)
+            .order_by("id")
+            .values_list("test_case__case_id", flat=True)[:500]
+        )
+        return {
+            "project_id": run.project_id,
+            "project_slug": run.project.slug,
+            "section_id": section.id,
+            "leaf_section_id": leaf.id,
+            "other_section_id": section.id if leaf.parent_id != section.id else None,
+            "case_id": TestCase.objects.order_by("id").values_list("id", flat=True)[0],
+            "case_ids": list(
+                TestCase.objects.order_by("-id").values_list("id", flat=True)[:100]
+            ),
+            "run_id": run.id,
+            "run_case_ids": run_case_ids,
+            "search": TestCase.objects.order_by("id")
+            .values_list("title", flat=True)[0]
+            .split()[0],
+        }
+
+    def measure(self, name: str, call: Callable[[], Dict[str, Any]]):
+        """
+        Run `call` once to warm up and `repeat` times measured, every run in a
+        transaction that is rolled back, so writes see the same data each time.
+        The cache is cleared before every run, which the rollback does not
+        undo, so cached endpoints are measured with their queries.
+        """
+        durations, extra = [], {}
+        for i in range(self.repeat + 1):
+            cache.clear()
+            queries = QueryTimer()
+            with transaction.atomic(), connection.execute_wrapper(queries):
+                started = time.perf_counter()
+                extra = call()
+                duration = time.perf_counter() - started
+                transaction.set_rollback(True)
+            if i:
+                durations.append(duration)
+        return {
+            "name": name,
+            "queries": queries.queries,
+            "db_ms": queries.duration * 1000,
+            "median_ms": statistics.median(durations) * 1000,
+            "min_ms": min(durations) * 1000,
+            "max_ms": max(durations) * 1000,
+            **extra,
+        }
+
+    def measure_endpoint(self, name: str, method: str, path: str, body: Any):
+        def call():
+            if isinstance(body, Upload):
+                upload = SimpleUploadedFile(body.name, body.content)
+                response = self.client.post(path, {body.field: upload})
+            else:
+                response = getattr(self.client, method)(
+                    path, body, content_type="application/json"
+                )
+            # the exports are read to the end, like a client would
+            content = (
+                b"".join(response.streaming_content)
+                if response.streaming
+                else response.content
+            )
+            return {
+                "method": method.upper(),
+                "path": path,
+                "status": response.status_code,
+                "bytes": len(content),
+            }
+
+        return self.measure(name, call)
+
+    def measure_import(self, rows: int):
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=".csv", delete=False, newline=""
+        ) as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(IMPORT_COLUMNS)
+            for i in range(rows):
+                writer.writerow(
+                    [
+                        f"CB{i}",
+                        f"benchmark case {i}",
+                        "Yes",
+                        "",
+                        "",
+                        f"Benchmark > Section {i % 20}",
+                        "Smoke Test",
+                    ]
+                )
+
+        def call():
+            call_command("import_testcases", csv_file.name, stdout=StringIO())
+            return {"rows": rows}
+
+        try:
+            return self.measure("import_testcases", call)
+        finally:
+            os.remove(csv_file.name)
+
+    def format_result(self, result: Dict[str, Any], baseline: Optional[dict]) -> str:
+        line = (
+            f"{result['name']:<28} {result.get('status', ''):>3} "
+            f"{result['median_ms']:>9.1f}ms {result['queries']:>5} queries"
+        )
+        if baseline:
+            change = result["median_ms"] / baseline["median_ms"] - 1
+            line += (
+                f"  {change:+.0%} time, "
+                f"{result['queries'] - baseline['queries']:+d} queries"
+            )
+        return line
@@ -0,0 +1,48 @@
+import asyncio
+from typing import Any, Optional, Set
+
+from django.core.management.base import BaseCommand, CommandParser
+
+
+class Command(BaseCommand):
+    help = (
+        "pass testrun events between the processes of one machine, "
+        "set EVENT_BROKER to the same address"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=7474)
+
+    def handle(self, *args: Any, **options: Any) -> Optional[str]:
+        try:
+            asyncio.run(self.serve(options["host"], options["port"]))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    async def serve(self, host: str, port: int) -> None:
+        self.writers: Set[asyncio.StreamWriter] = set()
+        server = await asyncio.start_server(self.handle_client, host, port)
+        self.stdout.write(f"event broker listening on {host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    async def handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.writers.add(writer)
+        try:
+            # every line is one event, sent on to all processes, the sender included
+            async for line in reader:
+                for client in list(self.writers):
+                    try:
+                        client.write(line)
+                        await client.drain()
+                    except ConnectionError:
+                        self.writers.discard(client)
+        except ConnectionError:
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
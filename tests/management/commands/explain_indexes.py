@@ -0,0 +1,180 @@
+import importlib
+import json
+import statistics
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.apps import apps
+from django.db import connection, migrations, transaction
+from django.db.models import Max
+from tests import analytics, queries
+from tests.models import TestCase, TestResult, TestRun
+
+# the migration whose indexes are compared
+MIGRATION = "tests.migrations.0007_query_indexes"
+
+
+def new_indexes() -> List[str]:
+    operations = importlib.import_module(MIGRATION).Migration.operations
+    return [
+        operation.index.name
+        for operation in operations
+        if isinstance(operation, migrations.AddIndex)
+    ]
+
+
+def foreign_key_indexes() -> List[str]:
+    """CREATE INDEX statements of the foreign key indexes the migration drops."""
+    statements = []
+    for model_name, field_name in importlib.import_module(
+        MIGRATION
+    ).COVERED_FOREIGN_KEYS:
+        model = apps.get_model("tests", model_name)
+        table = model._meta.db_table
+        column = model._meta.get_field(field_name).column
+        name = connection.ops.quote_name(f"{table}_{column}_explain")
+        statements.append(
+            f"CREATE INDEX {name} ON {connection.ops.quote_name(table)} ({column})"
+        )
+    return statements
+
+
+class QueryRecorder:
+    """Database execute wrapper keeping the SELECTs that were executed."""
+
+    def __init__(self) -> None:
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith("SELECT"):
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        "explain and time the hot queries with and without the indexes of "
+        "migration 0007, the indexes are replaced by the foreign key indexes "
+        "of before in a transaction that is rolled back"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--output", help="file to write the results as json")
+
+    def handle(self, *args: Any, **options: Any) -> Optional[str]:
+        samples = self.samples()
+        if samples is None:
+            raise CommandError("no testruns with results, run generate_data first")
+        self.repeat = options["repeat"]
+        self.indexes = new_indexes()
+        cases = self.cases(**samples)
+
+        if connection.vendor == "postgresql":
+            # plans depend on the table statistics
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+        results = {
+            name: {"with": self.measure(call, "with")} for name, call in cases.items()
+        }
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for name in self.indexes:
+                    cursor.execute(f"DROP INDEX {connection.ops.quote_name(name)}")
+                for statement in foreign_key_indexes():
+                    cursor.execute(statement)
+            for name, call in cases.items():
+                results[name]["without"] = self.measure(call, "without")
+            transaction.set_rollback(True)
+
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(
+                    {"database": connection.vendor, "results": results},
+                    output,
+                    indent=2,
+                )
+        for name, result in results.items():
+            self.stdout.write(self.format_result(name, result))
+        return
+
+    def samples(self) -> Optional[Dict[str, int]]:
+        result = TestResult.objects.select_related("test_run", "test_case").first()
+        if result is None:
+            return None
+        return {
+            "run_id": result.test_run_id,
+            "project_id": result.test_run.project_id,
+            "case_id": result.test_case_id,
+            "section_id": result.test_case.section_id,
+        }
+
+    def cases(
+        self, run_id: int, project_id: int, case_id: int, section_id: int
+    ) -> Dict[str, Callable[[], Any]]:
+        failed = [TestResult.Status.FAILED, TestResult.Status.RETEST]
+        return {
+            "clone_failed_results": lambda: list(
+                TestResult.objects.filter(
+                    test_run_id=run_id, status__in=failed
+                ).values_list("test_case_id", "priority")
+            ),
+            "last_failure": lambda: TestResult.objects.filter(
+                test_case_id=case_id, status=TestResult.Status.FAILED
+            ).aggregate(Max("updated_at")),
+            "flakiness": lambda: analytics.flakiness(limit=20),
+            "testruns_newest": lambda: list(
+                queries.testrun_summaries().order_by("-created_at", "-id")[:20]
+            ),
+            "testruns_of_project": lambda: list(
+                queries.testrun_summaries(
+                    TestRun.objects.filter(project_id=project_id)
+                ).order_by("-created_at", "-id")[:20]
+            ),
+            "testcases_of_section": lambda: list(
+                TestCase.objects.filter(section_id=section_id).order_by("case_id")
+            ),
+        }
+
+    def measure(self, call: Callable[[], Any], label: str) -> Dict[str, Any]:
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            call()
+        durations = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            call()
+            durations.append(time.perf_counter() - started)
+
+        plans = [self.explain(sql, params, label) for sql, params in recorder.queries]
+        return {
+            "median_ms": statistics.median(durations) * 1000,
+            "plans": plans,
+            "indexes": sorted(
+                {name for plan in plans for name in self.indexes if name in plan}
+            ),
+        }
+
+    def explain(self, sql: str, params, label: str) -> str:
+        # sqlite3 caches prepared statements by their text, and a cached
+        # EXPLAIN still shows the plan of before the indexes were dropped
+        prefix = f"{connection.ops.explain_query_prefix()} /* {label} */"
+        with connection.cursor() as cursor:
+            cursor.execute(f"{prefix} {sql}", params)
+            rows = cursor.fetchall()
+        # SQLite returns (id, parent, notused, detail), Postgres one line per row
+        return "\n".join(str(row[-1]) for row in rows)
+
+    def format_result(self, name: str, result: Dict[str, Any]) -> str:
+        with_indexes, without = result["with"], result["without"]
+        used = ", ".join(with_indexes["indexes"]) or "none of the new indexes"
+        lines = [
+            f"{name:<24} {with_indexes['median_ms']:8.2f}ms with, "
+            f"{without['median_ms']:8.2f}ms without indexes, uses {used}"
+        ]
+        for label, measured in (("with", with_indexes), ("without", without)):
+            for plan in measured["plans"]:
+                lines.append(f"  {label}:")
+                lines += [f"    {line}" for line in plan.splitlines()]
+        return "\n".join(lines)
@@ -0,0 +1,50 @@
+from typing import Any, Optional
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from tests.export import (
+    TESTCASE_FORMATS,
+    TESTRUN_FORMATS,
+    export_testcases,
+    export_testrun,
+)
+from tests.models import TestRun
+
+
+class Command(BaseCommand):
+    help = (
+        "export all testcases, or the results of a testrun, as csv, ndjson or junit xml"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "run_id",
+            nargs="?",
+            type=int,
+            help="testrun to export, all testcases if not given",
+        )
+        parser.add_argument("--format", choices=TESTRUN_FORMATS, default="csv")
+        parser.add_argument("--output", help="file to write, stdout if not given")
+
+    def handle(self, *args: Any, **options: Any) -> Optional[str]:
+        format = options["format"]
+        if options["run_id"] is None:
+            if format not in TESTCASE_FORMATS:
+                raise CommandError(
+                    f"testcases can only be exported as {', '.join(TESTCASE_FORMATS)}"
+                )
+            content = export_testcases(format)
+        else:
+            testrun = TestRun.objects.filter(id=options["run_id"]).first()
+            if testrun is None:
+                raise CommandError(f"could not find testrun {options['run_id']}")
+            content = export_testrun(testrun, format)
+
+        if options["output"] is None:
+            # OutputWrapper ends every write with a newline unless told not to
+            for chunk in content:
+                self.stdout.write(chunk, ending="")
+            return
+        with open(options["output"], "w", newline="") as out:
+            for chunk in content:
+                out.write(chunk)
+        return
@@ -0,0 +1,173 @@
+import random
+import time
+from typing import Any, List, Optional
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import transaction
+from django.db.models import Max
+from django.utils.text import slugify
+from tests import stats
+from tests.models import Project, Section, TestCase, TestResult, TestRun
+
+WORDS = (
+    "login logout checkout cart payment invoice search filter profile settings "
+    "password upload download export import report dashboard notification email "
+    "account admin user role permission session token order shipping discount "
+    "language currency timezone mobile desktop api webhook sync backup restore"
+).split()
+STATUS_WEIGHTS = {
+    TestResult.Status.PASSED: 70,
+    TestResult.Status.FAILED: 10,
+    TestResult.Status.UNTESTED: 10,
+    TestResult.Status.SKIPPED: 5,
+    TestResult.Status.RETEST: 5,
+}
+PRIORITY_WEIGHTS = {
+    TestResult.Priority.LOW: 30,
+    TestResult.Priority.MEDIUM: 50,
+    TestResult.Priority.HIGH: 20,
+}
+
+
+class Command(BaseCommand):
+    help = "generate a synthetic dataset of projects, sections, testcases and runs"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--projects", type=int, default=3)
+        parser.add_argument(
+            "--depth", type=int, default=3, help="levels of the section tree"
+        )
+        parser.add_argument(
+            "--fan-out", type=int, default=5, help="child sections per section"
+        )
+        parser.add_argument("--testcases", type=int, default=5000)
+        parser.add_argument("--runs", type=int, default=30)
+        parser.add_argument(
+            "--results",
+            type=int,
+            default=1000,
+            help="testcases per run, capped at the number of testcases",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="same seed, same dataset"
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args: Any, **options: Any) -> Optional[str]:
+        if options["depth"] < 1 or options["fan_out"] < 1:
+            raise CommandError("--depth and --fan-out have to be at least 1")
+
+        self.random = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        started = time.monotonic()
+        with transaction.atomic():
+            projects = self.create_projects(options["projects"])
+            sections = self.create_sections(options["depth"], options["fan_out"])
+            testcase_ids = self.create_testcases(options["testcases"], sections)
+            runs = self.create_runs(options["runs"], projects)
+            results = self.create_results(runs, testcase_ids, options["results"])
+            # bulk_create sends no signals, which keep the run stats up to date
+            stats.recount([run.pk for run in runs])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"generated {len(projects)} projects, {len(sections)} sections, "
+                f"{len(testcase_ids)} testcases, {len(runs)} runs and "
+                f"{results} results in {time.monotonic() - started:.1f}s"
+            )
+        )
+        return
+
+    def words(self, count: int) -> str:
+        return " ".join(self.random.choices(WORDS, k=count))
+
+    def next_number(self, model) -> int:
+        # the numbers of earlier runs are below their ids, unlike count() after
+        # deletes, so names and case ids do not collide with them
+        return model.objects.aggregate(Max("id"))["id__max"] or 0
+
+    def create_projects(self, count: int) -> List[Project]:
+        start = self.next_number(Project)
+        # bulk_create skips Project.save, so the slug is set here
+        projects = []
+        for i in range(start, start + count):
+            name = f"Project {i} {self.words(1)}"
+            projects.append(Project(name=name, slug=slugify(name)))
+        return Project.objects.bulk_create(projects)
+
+    def create_sections(self, depth: int, fan_out: int) -> List[Section]:
+        sections, parents = [], [None]
+        for level in range(depth):
+            # the index keeps the names of siblings unique
+            children = [
+                Section(name=f"{self.words(2).title()} {i}", parent=parent)
+                for parent in parents
+                for i in range(fan_out)
+            ]
+            parents = Section.objects.bulk_create(children, batch_size=self.batch_size)
+            sections += parents
+        return sections
+
+    def create_testcases(self, count: int, sections: List[Section]) -> List[int]:
+        start = self.next_number(TestCase)
+        testcases = []
+        for i in range(start, start + count):
+            testcase = TestCase(
+                case_id=f"C{i}",
+                title=f"{self.words(1).title()} {self.words(4)}",
+                is_automation=self.random.random() < 0.6,
+                section=self.random.choice(sections),
+                expected_result=self.words(8),
+                preconditions=self.words(5),
+                type=self.random.choice(TestCase.TestType.values),
+            )
+            # bulk_create skips TestCase.save, which keeps the hash up to date
+            testcase.content_hash = testcase.compute_content_hash()
+            testcases.append(testcase)
+        TestCase.objects.bulk_create(testcases, batch_size=self.batch_size)
+        return list(
+            TestCase.objects.filter(
+                case_id__in=[testcase.case_id for testcase in testcases]
+            ).values_list("id", flat=True)
+        )
+
+    def create_runs(self, count: int, projects: List[Project]) -> List[TestRun]:
+        if not projects:
+            return []
+        runs = [
+            TestRun(
+                project=self.random.choice(projects),
+                title=f"Run {i} {self.words(2)}",
+                description=self.words(10),
+                environment=self.random.choice(TestRun.Environment.values),
+            )
+            for i in range(count)
+        ]
+        return TestRun.objects.bulk_create(runs, batch_size=self.batch_size)
+
+    def create_results(
+        self, runs: List[TestRun], testcase_ids: List[int], per_run: int
+    ) -> int:
+        per_run = min(per_run, len(testcase_ids))
+        statuses, status_weights = zip(*STATUS_WEIGHTS.items())
+        priorities, priority_weights = zip(*PRIORITY_WEIGHTS.items())
+        created = 0
+        for run in runs:
+            case_ids = self.random.sample(testcase_ids, per_run)
+            results = [
+                TestResult(
+                    test_run=run,
+                    test_case_id=case_id,
+                    status=status,
+                    priority=priority,
+                    details=self.words(6) if status == TestResult.Status.FAILED else "",
+                )
+                for case_id, status, priority in zip(
+                    case_ids,
+                    self.random.choices(statuses, status_weights, k=per_run),
+                    self.random.choices(priorities, priority_weights, k=per_run),
+                )
+            ]
+            TestResult.objects.bulk_create(results, batch_size=self.batch_size)
+            created += len(results)
+        return created
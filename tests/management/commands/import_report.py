@@ -0,0 +1,42 @@
+from typing import Any, Optional
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from tests.models import TestRun
+from tests.reports import PARSERS, import_report
+import os.path
+
+
+class Command(BaseCommand):
+    help = "import a junit xml or json lines test report into a testrun"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("run_id", type=int)
+        parser.add_argument("report_file", type=str)
+        parser.add_argument("--format", choices=list(PARSERS), default="junit")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="number of results written per transaction",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> Optional[str]:
+        report_filepath = options["report_file"]
+        if not os.path.isfile(report_filepath):
+            raise CommandError(f"could not find file {report_filepath}")
+        if not TestRun.objects.filter(id=options["run_id"]).exists():
+            raise CommandError(f"could not find testrun {options['run_id']}")
+
+        with open(report_filepath, "rb") as report:
+            counts = import_report(
+                options["run_id"], report, options["format"], options["batch_size"]
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                ", ".join(
+                    f"{counts[outcome]} {outcome}"
+                    for outcome in ("updated", "unchanged", "unknown", "unmapped")
+                )
+            )
+        )
+        return
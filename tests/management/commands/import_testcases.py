@@ -1,7 +1,11 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import islice
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import csv
+import time
 
 # case_id
 # title
@@ -15,52 +19,233 @@ import csv
 
 # 'ID', 'Title', 'Automation Type', 'Automation required?', 'Created By', 'Created On', 'Estimate', 'Expected Result', 'Forecast', 'Goals', 'Mission', 'PR link', 'Preconditions', 'Priority', 'References', 'Section', 'Section Depth', 'Section Description', 'Section Hierarchy', 'Steps', 'Steps (Additional Info)', 'Steps (Expected Result)', 'Steps (References)', 'Steps (Shared step ID)', 'Steps (Step)', 'Suite', 'Suite ID', 'Template', 'Ticket URL', 'Ticket link', 'Type', 'Updated By', 'Updated On'
 
+import django
 from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import transaction
+from tests.cache import invalidate
 from tests.models import TestCase, Section
+from tests.results import delete_testcases
 import os.path
 
+PRUNE_BATCH_SIZE = 500
+
+
+def normalize_row(row: Dict[str, str]) -> Dict[str, Any]:
+    """Map a TestRail export row to its case id, section hierachy and fields."""
+    return {
+        "case_id": row["ID"],
+        "section_hierachy": tuple(
+            section.strip() for section in row["Section Hierarchy"].strip().split(">")
+        ),
+        "fields": {
+            "title": row["Title"],
+            "is_automation": True if row["Automation required?"] == "Yes" else False,
+            "expected_result": row["Expected Result"],
+            "preconditions": row["Preconditions"],
+            "type": TestCase.TestType.SMOKE
+            if row["Type"].startswith("Smoke")
+            else TestCase.TestType.FUNCTIONAL,
+        },
+    }
+
+
+def read_chunks(csv_filepath: str, batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    with open(csv_filepath) as csv_file:
+        reader = csv.DictReader(csv_file, delimiter=",")
+        while True:
+            chunk = [normalize_row(row) for row in islice(reader, batch_size)]
+            if not chunk:
+                return
+            yield chunk
+
+
+def parse_file(csv_filepath: str, batch_size: int) -> List[List[Dict[str, Any]]]:
+    """Parse and normalize a whole file, runs inside the worker processes."""
+    return list(read_chunks(csv_filepath, batch_size))
+
+
+class SectionCache:
+    """
+    In-memory map of section hierachies to section ids. All existing sections
+    are loaded once, missing ones are created in bulk one level at a time.
+    """
+
+    def __init__(self) -> None:
+        self.ids: Dict[Tuple[Optional[int], str], int] = {
+            (parent_id, name): pk
+            for pk, parent_id, name in Section.objects.values_list(
+                "id", "parent_id", "name"
+            )
+        }
+        self.created = 0
+
+    def resolve(self, hierachies: Iterable[Tuple[str, ...]]) -> Dict[tuple, int]:
+        hierachies = set(hierachies)
+        resolved: Dict[tuple, Optional[int]] = {(): None}
+        for depth in range(1, max(map(len, hierachies), default=0) + 1):
+            missing = {}
+            for hierachy in hierachies:
+                if len(hierachy) < depth or hierachy[:depth] in resolved:
+                    continue
+                key = (resolved[hierachy[: depth - 1]], hierachy[depth - 1])
+                if key not in self.ids:
+                    missing[key] = Section(parent_id=key[0], name=key[1])
+            for section in Section.objects.bulk_create(missing.values()):
+                self.ids[(section.parent_id, section.name)] = section.pk
+            self.created += len(missing)
+            for hierachy in hierachies:
+                if len(hierachy) >= depth:
+                    key = (resolved[hierachy[: depth - 1]], hierachy[depth - 1])
+                    resolved[hierachy[:depth]] = self.ids[key]
+        return resolved
+
 
 class Command(BaseCommand):
     help = "import csv testcases"
 
     def add_arguments(self, parser: CommandParser) -> None:
         parser.add_argument("csv_file", nargs="+", type=str)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="number of rows read and written per transaction",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="number of processes parsing files, the database is written by one",
+        )
+        parser.add_argument(
+            "--sync",
+            action="store_true",
+            help="only write testcases whose content changed since the last import",
+        )
+        parser.add_argument(
+            "--prune",
+            action="store_true",
+            help="delete testcases missing from the export, requires --sync",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="run the whole import, but roll back all changes",
+        )
 
     def handle(self, *args: Any, **options: Any) -> Optional[str]:
-        csv_filepath = options["csv_file"][0]
-        if not os.path.isfile(csv_filepath):
-            raise CommandError(f"could not find file {csv_filepath}")
-
-        with open(csv_filepath) as csv_file:
-            reader = csv.DictReader(csv_file, delimiter=",")
-            for row in reader:
-                # create sections
-                db_sections = []
-                section_hierachy = [
-                    section.strip()
-                    for section in row["Section Hierarchy"].strip().split(">")
-                ]
-                for i, section in enumerate(section_hierachy):
-                    parent = None if i == 0 else db_sections[i - 1]
-
-                    new_section, created = Section.objects.get_or_create(
-                        name=section, parent=parent
-                    )
-                    db_sections.append(new_section)
-
-                # create testcases
-                new_test_dict = {
-                    "case_id": row["ID"],
-                    "title": row["Title"],
-                    "is_automation": True
-                    if row["Automation required?"] == "Yes"
-                    else False,
-                    "section_id": db_sections[-1].id,
-                    "expected_result": row["Expected Result"],
-                    "preconditions": row["Preconditions"],
-                    "type": TestCase.TestType.SMOKE
-                    if row["Type"].startswith("Smoke")
-                    else TestCase.TestType.FUNCTIONAL,
-                }
-                new_testcase, create = TestCase.objects.get_or_create(**new_test_dict)
+        csv_filepaths = options["csv_file"]
+        for csv_filepath in csv_filepaths:
+            if not os.path.isfile(csv_filepath):
+                raise CommandError(f"could not find file {csv_filepath}")
+
+        if options["prune"] and not options["sync"]:
+            raise CommandError("--prune can only be used together with --sync")
+
+        self.sync = options["sync"]
+        self.seen_case_ids = set()
+        self.rows = self.created = self.updated = self.unchanged = self.pruned = 0
+        self.started = time.monotonic()
+        # a dry run needs one outer transaction to roll back, including sections
+        with transaction.atomic() if options["dry_run"] else nullcontext():
+            sections = SectionCache()
+            for csv_filepath, chunks in self.parse_files(csv_filepaths, options):
+                for chunk in chunks:
+                    with transaction.atomic():
+                        self.write_chunk(chunk, sections)
+                    self.report()
+                self.stdout.write(f"finished {csv_filepath}")
+            if options["prune"]:
+                self.prune()
+            if options["dry_run"]:
+                transaction.set_rollback(True)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{'dry run: ' if options['dry_run'] else ''}"
+                f"imported {self.rows} rows in {time.monotonic() - self.started:.1f}s, "
+                f"{self.created} testcases created, {self.updated} updated, "
+                f"{self.unchanged} unchanged, {self.pruned} pruned, "
+                f"{sections.created} sections created"
+            )
+        )
         return
+
+    def parse_files(self, csv_filepaths: List[str], options: Dict[str, Any]):
+        """
+        Yield the chunks of every file. With more than one worker, files are
+        parsed in a process pool while this process keeps writing the files
+        that are already done, in the order they were given.
+        """
+        batch_size = options["batch_size"]
+        if options["workers"] <= 1 or len(csv_filepaths) == 1:
+            for csv_filepath in csv_filepaths:
+                yield csv_filepath, read_chunks(csv_filepath, batch_size)
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=options["workers"], initializer=django.setup
+        ) as executor:
+            parsed_files = executor.map(
+                parse_file, csv_filepaths, [batch_size] * len(csv_filepaths)
+            )
+            yield from zip(csv_filepaths, parsed_files)
+
+    def write_chunk(self, chunk: List[Dict[str, Any]], sections: SectionCache):
+        section_ids = sections.resolve(row["section_hierachy"] for row in chunk)
+        # later rows of the same case win, like they did with one row at a time
+        testcases = {
+            row["case_id"]: TestCase(
+                case_id=row["case_id"],
+                section_id=section_ids[row["section_hierachy"]],
+                **row["fields"],
+            )
+            for row in chunk
+        }
+        hashes = dict(
+            TestCase.objects.filter(case_id__in=testcases.keys()).values_list(
+                "case_id", "content_hash"
+            )
+        )
+        self.seen_case_ids.update(testcases.keys())
+
+        changed = []
+        for testcase in testcases.values():
+            testcase.content_hash = testcase.compute_content_hash()
+            if self.sync and hashes.get(testcase.case_id) == testcase.content_hash:
+                self.unchanged += 1
+            else:
+                changed.append(testcase)
+        # a single INSERT .. ON CONFLICT (case_id) DO UPDATE per batch
+        TestCase.objects.bulk_create(
+            changed,
+            update_conflicts=True,
+            unique_fields=["case_id"],
+            update_fields=[*TestCase.CONTENT_FIELDS, "content_hash", "updated_at"],
+        )
+        # bulk_create sends no post_save, see signals.invalidate_testcases
+        if changed:
+            invalidate("testcases")
+
+        updated = sum(1 for testcase in changed if testcase.case_id in hashes)
+        self.rows += len(chunk)
+        self.created += len(changed) - updated
+        self.updated += updated
+
+    def prune(self) -> None:
+        stale_ids = [
+            pk
+            for pk, case_id in TestCase.objects.values_list("id", "case_id").iterator()
+            if case_id not in self.seen_case_ids
+        ]
+        for i in range(0, len(stale_ids), PRUNE_BATCH_SIZE):
+            delete_testcases(stale_ids[i : i + PRUNE_BATCH_SIZE])
+        self.pruned = len(stale_ids)
+
+    def report(self) -> None:
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(
+            f"{self.rows} rows ({self.rows / elapsed if elapsed else 0:.0f} rows/s), "
+            f"{self.created} created, {self.updated} updated, "
+            f"{self.unchanged} unchanged"
+        )
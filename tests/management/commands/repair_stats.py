@@ -0,0 +1,28 @@
+from typing import Any, Optional
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+from tests.models import TestRun
+from tests.stats import recount
+
+
+class Command(BaseCommand):
+    help = "count the results of testruns again and fix their stats"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "run_ids",
+            nargs="*",
+            type=int,
+            help="testruns to repair, all testruns if not given",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> Optional[str]:
+        run_ids = options["run_ids"] or None
+        with transaction.atomic():
+            repaired = recount(run_ids)
+        checked = len(run_ids) if run_ids else TestRun.objects.count()
+        self.stdout.write(
+            self.style.SUCCESS(f"repaired the stats of {repaired} of {checked} runs")
+        )
+        return
@@ -0,0 +1,54 @@
+import json
+from typing import Any, Optional
+from urllib.error import URLError
+from urllib.request import urlopen
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+SORT_KEYS = {
+    "mean": "mean_duration",
+    "max": "max_duration",
+    "total": "total_duration",
+    "queries": "mean_queries",
+    "db": "mean_db_duration",
+    "size": "mean_response_bytes",
+}
+
+
+class Command(BaseCommand):
+    help = "print the slowest routes recorded by a running server"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--url",
+            default="http://127.0.0.1:8000/metrics",
+            help="metrics endpoint of the server, metrics are kept per process",
+        )
+        parser.add_argument("--limit", type=int, default=10)
+        parser.add_argument("--sort", choices=SORT_KEYS, default="mean")
+
+    def handle(self, *args: Any, **options: Any) -> Optional[str]:
+        try:
+            with urlopen(f"{options['url']}?format=json") as response:
+                routes = json.load(response)
+        except (URLError, ValueError) as error:
+            raise CommandError(f"could not read metrics: {error}")
+
+        for route in routes:
+            route["total_duration"] = route["mean_duration"] * route["requests"]
+        routes.sort(key=lambda route: route[SORT_KEYS[options["sort"]]], reverse=True)
+
+        self.stdout.write(
+            f"{'route':<60} {'requests':>8} {'mean ms':>8} {'max ms':>8} "
+            f"{'queries':>7} {'db ms':>8} {'bytes':>8}"
+        )
+        for route in routes[: options["limit"]]:
+            self.stdout.write(
+                f"{route['method'] + ' ' + route['route']:<60} "
+                f"{route['requests']:>8} "
+                f"{route['mean_duration'] * 1000:>8.1f} "
+                f"{route['max_duration'] * 1000:>8.1f} "
+                f"{route['mean_queries']:>7.1f} "
+                f"{route['mean_db_duration'] * 1000:>8.1f} "
+                f"{route['mean_response_bytes']:>8.0f}"
+            )
@@ -0,0 +1,294 @@
+"""
+Per route request metrics.
+
+`MetricsMiddleware` records latency, database queries, database time and
+response size of every request, `MetricsNinjaAPI` adds the time spent
+serializing the response. Both only run if the `REQUEST_METRICS` setting is
+on. The numbers are kept in the memory of each process (nothing is sent
+anywhere), returned as `Server-Timing` header of every response and served
+in the Prometheus text format by `metrics_view`.
+"""
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import Http404, HttpRequest, HttpResponse, JsonResponse
+from ninja import NinjaAPI
+
+from . import cache
+
+# upper bounds of the latency histogram in seconds, like the Prometheus clients
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def metrics_enabled() -> bool:
+    return getattr(settings, "REQUEST_METRICS", False)
+
+
+@dataclass
+class RouteStats:
+    requests: int = 0
+    duration: float = 0.0
+    max_duration: float = 0.0
+    queries: int = 0
+    db_duration: float = 0.0
+    render_duration: float = 0.0
+    response_bytes: int = 0
+    buckets: List[int] = field(default_factory=lambda: [0] * len(BUCKETS))
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "requests": self.requests,
+            "mean_duration": self.duration / self.requests,
+            "max_duration": self.max_duration,
+            "mean_queries": self.queries / self.requests,
+            "mean_db_duration": self.db_duration / self.requests,
+            "mean_render_duration": self.render_duration / self.requests,
+            "mean_response_bytes": self.response_bytes / self.requests,
+        }
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.routes: Dict[Tuple[str, str], RouteStats] = {}
+
+    def record(
+        self,
+        method: str,
+        route: str,
+        duration: float,
+        queries: int,
+        db_duration: float,
+        render_duration: float,
+        response_bytes: int,
+    ) -> None:
+        with self.lock:
+            stats = self.routes.setdefault((method, route), RouteStats())
+            stats.requests += 1
+            stats.duration += duration
+            stats.max_duration = max(stats.max_duration, duration)
+            stats.queries += queries
+            stats.db_duration += db_duration
+            stats.render_duration += render_duration
+            stats.response_bytes += response_bytes
+            bucket = bisect_left(BUCKETS, duration)
+            if bucket < len(BUCKETS):
+                stats.buckets[bucket] += 1
+
+    def snapshot(self) -> Dict[Tuple[str, str], RouteStats]:
+        with self.lock:
+            return {
+                key: RouteStats(**{**vars(stats), "buckets": list(stats.buckets)})
+                for key, stats in self.routes.items()
+            }
+
+    def clear(self) -> None:
+        with self.lock:
+            self.routes.clear()
+
+
+registry = Registry()
+
+
+class QueryTimer:
+    """Database execute wrapper counting queries and their duration."""
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.duration += time.perf_counter() - started
+
+
+# the timer of the request being measured, asgiref copies it into the
+# threads that run the database queries of async views
+current_timer: ContextVar[Optional[QueryTimer]] = ContextVar(
+    "current_timer", default=None
+)
+
+
+def time_queries(execute, sql, params, many, context):
+    timer = current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    # connections belong to a thread, the wrapper is added to every one of
+    # them; first, as execute_wrapper() removes the last one when it is done
+    if time_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, time_queries)
+
+
+class MetricsMiddleware:
+    """
+    Works in both modes, so under ASGI the async views are not switched to a
+    thread for the middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response) -> None:
+        if not metrics_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = QueryTimer()
+        token = current_timer.set(timer)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        return self.record(request, response, timer, time.perf_counter() - started)
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        timer = QueryTimer()
+        token = current_timer.set(timer)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        return self.record(request, response, timer, time.perf_counter() - started)
+
+    def record(
+        self,
+        request: HttpRequest,
+        response: HttpResponse,
+        timer: QueryTimer,
+        duration: float,
+    ) -> HttpResponse:
+        # streamed responses are not measured, their size is unknown here
+        size = 0 if response.streaming else len(response.content)
+        render_duration = getattr(request, "_render_duration", 0.0)
+        match = request.resolver_match
+        registry.record(
+            request.method,
+            f"/{match.route}" if match else "unmatched",
+            duration,
+            timer.queries,
+            timer.duration,
+            render_duration,
+            size,
+        )
+        response["Server-Timing"] = ", ".join(
+            [
+                f"app;dur={duration * 1000:.1f}",
+                f'db;dur={timer.duration * 1000:.1f};desc="{timer.queries} queries"',
+                f"render;dur={render_duration * 1000:.1f}",
+            ]
+        )
+        return response
+
+
+class MetricsNinjaAPI(NinjaAPI):
+    """NinjaAPI that measures how long the serialization of a response takes."""
+
+    def create_response(self, request: HttpRequest, data, **kwargs) -> HttpResponse:
+        if not metrics_enabled():
+            return super().create_response(request, data, **kwargs)
+        started = time.perf_counter()
+        response = super().create_response(request, data, **kwargs)
+        request._render_duration = time.perf_counter() - started
+        return response
+
+
+def _labels(method: str, route: str) -> str:
+    route = route.replace("\\", "\\\\").replace('"', '\\"')
+    return f'method="{method}",route="{route}"'
+
+
+def prometheus_text(
+    routes: Dict[Tuple[str, str], RouteStats],
+    cache_stats: Dict[str, Dict[str, int]],
+) -> str:
+    counters = [
+        ("requests_total", "Requests served.", "requests"),
+        ("db_queries_total", "Database queries executed.", "queries"),
+        ("db_duration_seconds_total", "Time spent in the database.", "db_duration"),
+        ("render_duration_seconds_total", "Time spent serializing.", "render_duration"),
+        ("response_bytes_total", "Size of the response bodies.", "response_bytes"),
+    ]
+    lines = []
+    for name, help_text, attribute in counters:
+        lines += [
+            f"# HELP qa_manager_{name} {help_text}",
+            f"# TYPE qa_manager_{name} counter",
+        ]
+        for (method, route), stats in routes.items():
+            value = getattr(stats, attribute)
+            lines.append(f"qa_manager_{name}{{{_labels(method, route)}}} {value}")
+
+    name = "qa_manager_request_duration_seconds"
+    lines += [
+        f"# HELP {name} Request latency.",
+        f"# TYPE {name} histogram",
+    ]
+    for (method, route), stats in routes.items():
+        labels = _labels(method, route)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, stats.buckets):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines += [
+            f'{name}_bucket{{{labels},le="+Inf"}} {stats.requests}',
+            f"{name}_sum{{{labels}}} {stats.duration}",
+            f"{name}_count{{{labels}}} {stats.requests}",
+        ]
+
+    cache_counters = {
+        "hits": "Responses served from the cache.",
+        "misses": "Responses missing in the cache.",
+    }
+    for outcome, help_text in cache_counters.items():
+        name = f"qa_manager_response_cache_{outcome}_total"
+        lines += [
+            f"# HELP {name} {help_text}",
+            f"# TYPE {name} counter",
+        ]
+        for endpoint, counts in cache_stats.items():
+            lines.append(f'{name}{{endpoint="{endpoint}"}} {counts[outcome]}')
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """Prometheus text, or the mean values per route with ?format=json."""
+    if not metrics_enabled():
+        raise Http404
+    routes = registry.snapshot()
+    if request.GET.get("format") == "json":
+        return JsonResponse(
+            [
+                {"method": method, "route": route, **stats.as_dict()}
+                for (method, route), stats in routes.items()
+            ],
+            safe=False,
+        )
+    return HttpResponse(
+        prometheus_text(routes, cache.stats.snapshot()),
+        content_type="text/plain; version=0.0.4",
+    )
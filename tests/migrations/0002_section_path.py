@@ -0,0 +1,43 @@
+# Generated by Django 4.1.7 on 2026-10-18 07:55
+
+from django.db import migrations, models
+
+
+def build_section_paths(apps, schema_editor):
+    Section = apps.get_model("tests", "Section")
+    sections = {section.id: section for section in Section.objects.all()}
+
+    def resolve(section):
+        if not section.path:
+            parent_path = "/"
+            if section.parent_id:
+                parent_path = resolve(sections[section.parent_id])
+            section.path = f"{parent_path}{section.id}/"
+            section.depth = section.path.count("/") - 2
+        return section.path
+
+    for section in sections.values():
+        resolve(section)
+    Section.objects.bulk_update(sections.values(), ["path", "depth"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tests", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="section",
+            name="depth",
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="section",
+            name="path",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=255
+            ),
+        ),
+        migrations.RunPython(build_section_paths, migrations.RunPython.noop),
+    ]
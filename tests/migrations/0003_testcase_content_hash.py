@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 08:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tests", "0002_section_path"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="testcase",
+            name="content_hash",
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+    ]
@@ -0,0 +1,106 @@
+from django.db import migrations
+
+# SQLite drops these triggers when Django remakes tests_testcase or
+# tests_section (AlterField, most AddFields). Add indexes to those tables with
+# AddIndex, and recreate the triggers after any operation that remakes them.
+SQLITE_FTS = [
+    """
+    CREATE VIRTUAL TABLE tests_testcase_fts
+    USING fts5(case_id, title, section, tokenize='trigram')
+    """,
+    """
+    INSERT INTO tests_testcase_fts(rowid, case_id, title, section)
+    SELECT t.id, t.case_id, t.title, COALESCE(s.name, '')
+    FROM tests_testcase t LEFT JOIN tests_section s ON s.id = t.section_id
+    """,
+    """
+    CREATE TRIGGER tests_testcase_fts_insert AFTER INSERT ON tests_testcase BEGIN
+        INSERT INTO tests_testcase_fts(rowid, case_id, title, section)
+        VALUES (new.id, new.case_id, new.title, COALESCE(
+            (SELECT name FROM tests_section WHERE id = new.section_id), ''
+        ));
+    END
+    """,
+    """
+    CREATE TRIGGER tests_testcase_fts_update
+    AFTER UPDATE OF case_id, title, section_id ON tests_testcase BEGIN
+        DELETE FROM tests_testcase_fts WHERE rowid = old.id;
+        INSERT INTO tests_testcase_fts(rowid, case_id, title, section)
+        VALUES (new.id, new.case_id, new.title, COALESCE(
+            (SELECT name FROM tests_section WHERE id = new.section_id), ''
+        ));
+    END
+    """,
+    """
+    CREATE TRIGGER tests_testcase_fts_delete AFTER DELETE ON tests_testcase BEGIN
+        DELETE FROM tests_testcase_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER tests_section_fts_update AFTER UPDATE OF name ON tests_section BEGIN
+        DELETE FROM tests_testcase_fts
+        WHERE rowid IN (SELECT id FROM tests_testcase WHERE section_id = new.id);
+        INSERT INTO tests_testcase_fts(rowid, case_id, title, section)
+        SELECT id, case_id, title, new.name FROM tests_testcase
+        WHERE section_id = new.id;
+    END
+    """,
+]
+
+SQLITE_FTS_REVERSE = [
+    "DROP TRIGGER IF EXISTS tests_section_fts_update",
+    "DROP TRIGGER IF EXISTS tests_testcase_fts_delete",
+    "DROP TRIGGER IF EXISTS tests_testcase_fts_update",
+    "DROP TRIGGER IF EXISTS tests_testcase_fts_insert",
+    "DROP TABLE IF EXISTS tests_testcase_fts",
+]
+
+POSTGRES_TRIGRAM = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    CREATE INDEX tests_testcase_title_trgm
+    ON tests_testcase USING gin (UPPER(title::text) gin_trgm_ops)
+    """,
+    """
+    CREATE INDEX tests_testcase_case_id_trgm
+    ON tests_testcase USING gin (UPPER(case_id::text) gin_trgm_ops)
+    """,
+]
+
+POSTGRES_TRIGRAM_REVERSE = [
+    "DROP INDEX IF EXISTS tests_testcase_case_id_trgm",
+    "DROP INDEX IF EXISTS tests_testcase_title_trgm",
+]
+
+
+def sqlite_has_fts(schema_editor) -> bool:
+    # the trigram tokenizer was added in SQLite 3.34
+    cursor = schema_editor.connection.cursor()
+    cursor.execute("SELECT sqlite_version()")
+    version = tuple(int(part) for part in cursor.fetchone()[0].split("."))
+    cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+    return version >= (3, 34) and bool(cursor.fetchone()[0])
+
+
+def run(statements_by_vendor):
+    def operation(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        if vendor == "sqlite" and not sqlite_has_fts(schema_editor):
+            return
+        for statement in statements_by_vendor.get(vendor, []):
+            schema_editor.execute(statement)
+
+    return operation
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tests", "0003_testcase_content_hash"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({"sqlite": SQLITE_FTS, "postgresql": POSTGRES_TRIGRAM}),
+            run({"sqlite": SQLITE_FTS_REVERSE, "postgresql": POSTGRES_TRIGRAM_REVERSE}),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.1.7 on 2026-10-18 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tests", "0004_testcase_search"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Tombstone",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("model", models.CharField(max_length=50)),
+                ("object_id", models.BigIntegerField()),
+                ("deleted_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="testcase",
+            index=models.Index(
+                fields=["updated_at", "id"], name="tests_testc_updated_d9de43_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="testresult",
+            index=models.Index(
+                fields=["updated_at", "id"], name="tests_testr_updated_64153f_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="testrun",
+            index=models.Index(
+                fields=["updated_at", "id"], name="tests_testr_updated_cfb082_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tombstone",
+            index=models.Index(
+                fields=["deleted_at", "id"], name="tests_tombs_deleted_368f27_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.1.7 on 2026-10-18 08:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_results(apps, schema_editor):
+    TestRun = apps.get_model("tests", "TestRun")
+    TestRunStats = apps.get_model("tests", "TestRunStats")
+    counts = {"total": models.Count("testresult")}
+    for status in ("untested", "passed", "failed", "skipped", "retest"):
+        counts[f"status_{status}"] = models.Count(
+            "testresult", filter=models.Q(testresult__status=status)
+        )
+    for priority in ("low", "medium", "high"):
+        counts[f"priority_{priority}"] = models.Count(
+            "testresult", filter=models.Q(testresult__priority=priority)
+        )
+    TestRunStats.objects.bulk_create(
+        (
+            TestRunStats(test_run_id=row.pop("id"), **row)
+            for row in TestRun.objects.annotate(**counts).values("id", *counts)
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tests", "0005_change_feed"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TestRunStats",
+            fields=[
+                (
+                    "test_run",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to="tests.testrun",
+                    ),
+                ),
+                ("total", models.IntegerField(default=0)),
+                ("status_untested", models.IntegerField(default=0)),
+                ("status_passed", models.IntegerField(default=0)),
+                ("status_failed", models.IntegerField(default=0)),
+                ("status_skipped", models.IntegerField(default=0)),
+                ("status_retest", models.IntegerField(default=0)),
+                ("priority_low", models.IntegerField(default=0)),
+                ("priority_medium", models.IntegerField(default=0)),
+                ("priority_high", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_results, migrations.RunPython.noop),
+    ]
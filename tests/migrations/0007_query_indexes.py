@@ -0,0 +1,137 @@
+# Generated by Django 4.1.7 on 2026-10-18 08:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# foreign keys whose own index is the prefix of one of the indexes above
+COVERED_FOREIGN_KEYS = [
+    ("testcase", "section"),
+    ("testresult", "test_case"),
+    ("testresult", "test_run"),
+    ("testrun", "project"),
+]
+
+
+def drop_foreign_key_indexes(apps, schema_editor):
+    # AlterField would remake the tables on SQLite, which drops the search
+    # triggers of tests_testcase, so the indexes are dropped by hand
+    connection = schema_editor.connection
+    for model_name, field_name in COVERED_FOREIGN_KEYS:
+        model = apps.get_model("tests", model_name)
+        column = model._meta.get_field(field_name).column
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, model._meta.db_table
+            )
+        for name, constraint in constraints.items():
+            if (
+                constraint["index"]
+                and constraint["columns"] == [column]
+                and not constraint["unique"]
+                and not constraint["primary_key"]
+            ):
+                schema_editor.execute(f"DROP INDEX {schema_editor.quote_name(name)}")
+
+
+def create_foreign_key_indexes(apps, schema_editor):
+    for model_name, field_name in COVERED_FOREIGN_KEYS:
+        model = apps.get_model("tests", model_name)
+        field = model._meta.get_field(field_name)
+        schema_editor.execute(schema_editor._create_index_sql(model, fields=[field]))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tests", "0006_testrun_stats"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="testcase",
+            index=models.Index(
+                fields=["section", "case_id"], name="tests_testc_section_724bc1_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="testresult",
+            index=models.Index(
+                fields=["test_run", "status"], name="tests_testr_test_ru_83d044_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="testresult",
+            index=models.Index(
+                fields=["test_case", "status", "updated_at"],
+                name="tests_testr_test_ca_0e61b1_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="testresult",
+            index=models.Index(
+                condition=models.Q(("status__in", ["passed", "failed"])),
+                fields=["test_case", "test_run"],
+                name="tests_testresult_executed_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="testrun",
+            index=models.Index(
+                fields=["created_at", "id"], name="tests_testr_created_0aa052_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="testrun",
+            index=models.Index(
+                fields=["project", "created_at", "id"],
+                name="tests_testr_project_76388a_idx",
+            ),
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(
+                    drop_foreign_key_indexes, create_foreign_key_indexes
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name="testcase",
+                    name="section",
+                    field=models.ForeignKey(
+                        db_index=False,
+                        default=None,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="tests.section",
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="testresult",
+                    name="test_case",
+                    field=models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="tests.testcase",
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="testresult",
+                    name="test_run",
+                    field=models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="tests.testrun",
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="testrun",
+                    name="project",
+                    field=models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="testruns",
+                        to="tests.project",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -1,8 +1,16 @@
-from typing import List
-from django.db import models
+import hashlib
+import json
+from typing import Iterable, List, Optional
+from asgiref.sync import sync_to_async
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.query import ModelIterable
+from django.db.models.functions import Concat, Substr
 from django.template.defaultfilters import slugify
 from django.utils.translation import gettext_lazy as _
 
+from .cache import invalidate
+
 
 class Project(models.Model):
     name = models.CharField(max_length=255, unique=True)
@@ -16,6 +24,113 @@ class Project(models.Model):
         return self.name
 
 
+class SectionHierachyQuerySet(models.QuerySet):
+    """
+    QuerySet that resolves the section hierachy of every fetched row in bulk,
+    instead of once per row when the hierachy is serialized.
+    """
+
+    _section_lookup = None
+
+    def with_section_hierachy(self, lookup: str = "section"):
+        clone = self.select_related(lookup) if lookup else self._chain()
+        clone._section_lookup = lookup
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._section_lookup = self._section_lookup
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is not None
+        super()._fetch_all()
+        if fetched or self._section_lookup is None:
+            return
+        if not issubclass(self._iterable_class, ModelIterable):
+            return
+        self._prime_hierachies(self._result_cache)
+
+    async def aiterator(self, chunk_size=2000):
+        # aiterator() bypasses _fetch_all, so prime one chunk at a time
+        if self._section_lookup is None:
+            async for obj in super().aiterator(chunk_size):
+                yield obj
+            return
+        chunk = []
+        async for obj in super().aiterator(chunk_size):
+            chunk.append(obj)
+            if len(chunk) == chunk_size:
+                await sync_to_async(self._prime_hierachies)(chunk)
+                for obj in chunk:
+                    yield obj
+                chunk = []
+        await sync_to_async(self._prime_hierachies)(chunk)
+        for obj in chunk:
+            yield obj
+
+    def _prime_hierachies(self, objs) -> None:
+        Section.objects.prime_hierachies(self._get_section(obj) for obj in objs)
+
+    def _get_section(self, obj) -> Optional["Section"]:
+        for attr in filter(None, self._section_lookup.split("__")):
+            if obj is None:
+                break
+            obj = getattr(obj, attr)
+        return obj
+
+
+class SectionQuerySet(SectionHierachyQuerySet):
+    def with_section_hierachy(self, lookup: str = ""):
+        return super().with_section_hierachy(lookup)
+
+    def subtree(self, section: "Section", depth: Optional[int] = None):
+        """Sections below (and including) `section`, optionally limited in depth."""
+        sections = self.filter(path__startswith=section.path)
+        if depth is not None:
+            sections = sections.filter(depth__lte=section.depth + depth)
+        return sections
+
+    def prime_hierachies(self, sections: Iterable["Section"]) -> None:
+        """Resolve the name hierachy of all given sections with a single query."""
+        sections = [
+            section
+            for section in sections
+            if section is not None and section._section_hierachy is None
+        ]
+        ancestor_ids = {pk for section in sections for pk in section.path_ids[:-1]}
+        names = {}
+        if ancestor_ids:
+            names = dict(self.filter(pk__in=ancestor_ids).values_list("id", "name"))
+        for section in sections:
+            section._section_hierachy = [
+                names[pk] for pk in section.path_ids[:-1] if pk in names
+            ] + [section.name]
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Create sections in bulk and fill in their paths. Parents have to exist
+        before their children are created, so create one level at a time.
+        """
+        with transaction.atomic():
+            objs = super().bulk_create(objs, *args, **kwargs)
+            created = [section for section in objs if section.pk is not None]
+            parent_ids = {section.parent_id for section in created}
+            parent_paths = dict(
+                Section.objects.filter(pk__in=parent_ids).values_list("id", "path")
+            )
+            for section in created:
+                parent_path = parent_paths.get(section.parent_id, "/")
+                section.path = f"{parent_path}{section.pk}/"
+                section.depth = section.path.count("/") - 2
+            self.bulk_update(
+                created, ["path", "depth"], batch_size=kwargs.get("batch_size")
+            )
+        # bulk_create sends no post_save, see signals.invalidate_sections
+        invalidate("sections")
+        return objs
+
+
 class Section(models.Model):
     parent = models.ForeignKey(
         "self",
@@ -26,6 +141,13 @@ class Section(models.Model):
         related_name="children",
     )
     name = models.CharField(max_length=255)
+    # materialized path of primary keys including the section itself, e.g. "/1/4/9/"
+    path = models.CharField(max_length=255, db_index=True, editable=False, default="")
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    objects = SectionQuerySet.as_manager()
+
+    _section_hierachy = None
 
     class Meta:
         constraints = [
@@ -34,18 +156,52 @@ class Section(models.Model):
             )
         ]
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._update_path()
+        self._section_hierachy = None
+
+    def _update_path(self) -> None:
+        parent_ids = self.path_ids[:-1]
+        current_parent_id = parent_ids[-1] if parent_ids else None
+        if self.path and current_parent_id == self.parent_id:
+            return
+
+        parent_path = "/"
+        if self.parent_id:
+            parent_path = Section.objects.values_list("path", flat=True).get(
+                pk=self.parent_id
+            )
+        if self.path and parent_path.startswith(self.path):
+            raise ValueError("A section can not be moved into its own subtree!")
+
+        path = f"{parent_path}{self.pk}/"
+        depth = path.count("/") - 2
+        if self.path:
+            # re-parented, move the whole subtree along
+            Section.objects.filter(path__startswith=self.path).update(
+                path=Concat(Value(path), Substr("path", len(self.path) + 1)),
+                depth=F("depth") + (depth - self.depth),
+            )
+        else:
+            Section.objects.filter(pk=self.pk).update(path=path, depth=depth)
+        self.path = path
+        self.depth = depth
+
+    @property
+    def path_ids(self) -> List[int]:
+        return [int(pk) for pk in self.path.split("/") if pk]
+
     @property
     def all_child_testcases(self):
-        if self.children:
-            for child in self.children.all():
-                yield from child.all_child_testcases
-        yield self.testcase_set.all()
+        return TestCase.objects.filter(section__path__startswith=self.path)
 
     @property
     def section_hierachy(self) -> List[str]:
-        if self.parent:
-            yield from self.parent.section_hierachy
-        yield self.name
+        if self._section_hierachy is None:
+            Section.objects.prime_hierachies([self])
+        return self._section_hierachy
 
     @property
     def full_section_hierachy(self) -> str:
@@ -64,8 +220,9 @@ class TestCase(models.Model):
     case_id = models.CharField(max_length=8, unique=True)
     title = models.CharField(max_length=500)
     is_automation = models.BooleanField(default=False)
+    # indexed as the prefix of (section, case_id)
     section = models.ForeignKey(
-        Section, on_delete=models.SET_NULL, null=True, default=None
+        Section, on_delete=models.SET_NULL, null=True, default=None, db_index=False
     )
     expected_result = models.CharField(max_length=500, blank=True)
     preconditions = models.CharField(max_length=500, blank=True)
@@ -75,9 +232,37 @@ class TestCase(models.Model):
         name="type",
         max_length=max(len(v) for v in TestType.values),
     )
+    # hash over CONTENT_FIELDS, used by imports to skip unchanged testcases
+    content_hash = models.CharField(max_length=40, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = SectionHierachyQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["updated_at", "id"]),
+            # testcases of a section, in case id order
+            models.Index(fields=["section", "case_id"]),
+        ]
+
+    CONTENT_FIELDS = (
+        "title",
+        "is_automation",
+        "section_id",
+        "expected_result",
+        "preconditions",
+        "type",
+    )
+
+    def save(self, *args, **kwargs):
+        self.content_hash = self.compute_content_hash()
+        return super().save(*args, **kwargs)
+
+    def compute_content_hash(self) -> str:
+        content = [getattr(self, field) for field in self.CONTENT_FIELDS]
+        return hashlib.sha1(json.dumps(content).encode()).hexdigest()
+
     def __str__(self) -> str:
         return self.case_id
 
@@ -88,8 +273,9 @@ class TestRun(models.Model):
         STAGING = "staging", _("Staging")
         LIVE = "live", _("Live")
 
+    # indexed as the prefix of (project, created_at, id)
     project = models.ForeignKey(
-        Project, on_delete=models.CASCADE, related_name="testruns"
+        Project, on_delete=models.CASCADE, related_name="testruns", db_index=False
     )
     title = models.CharField(max_length=255)
     description = models.CharField(max_length=500)
@@ -101,6 +287,14 @@ class TestRun(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["updated_at", "id"]),
+            # newest runs first, of all projects and of one project
+            models.Index(fields=["created_at", "id"]),
+            models.Index(fields=["project", "created_at", "id"]),
+        ]
+
     def __str__(self) -> str:
         return self.title
 
@@ -118,8 +312,9 @@ class TestResult(models.Model):
         MEDIUM = "medium", _("Medium")
         HIGH = "high", _("High")
 
-    test_run = models.ForeignKey(TestRun, on_delete=models.CASCADE)
-    test_case = models.ForeignKey(TestCase, on_delete=models.CASCADE)
+    # indexed as the prefixes of (test_run, status) and (test_case, status, ...)
+    test_run = models.ForeignKey(TestRun, on_delete=models.CASCADE, db_index=False)
+    test_case = models.ForeignKey(TestCase, on_delete=models.CASCADE, db_index=False)
     status = models.CharField(
         choices=Status.choices,
         default=Status.UNTESTED,
@@ -134,12 +329,72 @@ class TestResult(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = SectionHierachyQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
                 fields=("test_run", "test_case"), name="unique testcase for run"
             )
         ]
+        indexes = [
+            models.Index(fields=["updated_at", "id"]),
+            # results of a run by status, e.g. to clone the failed ones
+            models.Index(fields=["test_run", "status"]),
+            # results of a testcase across runs and its last failure
+            models.Index(fields=["test_case", "status", "updated_at"]),
+            # executions of the flakiness query in analytics.py, which has to
+            # repeat the condition literally for the index to be used
+            models.Index(
+                fields=["test_case", "test_run"],
+                condition=models.Q(status__in=["passed", "failed"]),
+                name="tests_testresult_executed_idx",
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # the values the run stats counted, see signals.count_saved_result
+        instance._counted = tuple(
+            instance.__dict__.get(field)
+            for field in ("test_run_id", "status", "priority")
+        )
+        return instance
 
     def __str__(self) -> str:
         return f"Run #{self.test_run.pk} - Case: {self.test_case.case_id}"
+
+
+class TestRunStats(models.Model):
+    """Result counts of a testrun per status and priority, see stats.py."""
+
+    test_run = models.OneToOneField(
+        TestRun, on_delete=models.CASCADE, primary_key=True, related_name="stats"
+    )
+    total = models.IntegerField(default=0)
+    status_untested = models.IntegerField(default=0)
+    status_passed = models.IntegerField(default=0)
+    status_failed = models.IntegerField(default=0)
+    status_skipped = models.IntegerField(default=0)
+    status_retest = models.IntegerField(default=0)
+    priority_low = models.IntegerField(default=0)
+    priority_medium = models.IntegerField(default=0)
+    priority_high = models.IntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f"Stats of run #{self.test_run_id}"
+
+
+class Tombstone(models.Model):
+    """A deleted testcase, testrun or testresult, served by the change feed."""
+
+    model = models.CharField(max_length=50)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["deleted_at", "id"])]
+
+    def __str__(self) -> str:
+        return f"{self.model} #{self.object_id}"
@@ -0,0 +1,114 @@
+import base64
+import json
+from typing import Any, List, Literal, Optional, Sequence
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connection
+from django.db.models import Q, QuerySet
+
+from ninja import Field, Schema
+from ninja.conf import settings
+from ninja.errors import ValidationError
+from ninja.pagination import PaginationBase
+
+
+class KeysetPagination(PaginationBase):
+    """
+    Cursor pagination over a fixed ordering, which has to end with a unique field.
+
+    Instead of an offset the client passes back the opaque `next_cursor` of the
+    previous page, which encodes the ordering values of its last row. Every
+    page is then a single indexed range query, no matter how deep it is.
+
+    No total is counted by default. `count=exact` runs a full COUNT(*) and
+    `count=approx` asks the Postgres planner for its row estimate, or on other
+    databases counts up to APPROX_COUNT_LIMIT rows.
+    """
+
+    APPROX_COUNT_LIMIT = 10000
+
+    class Input(Schema):
+        cursor: str = None
+        limit: int = Field(settings.PAGINATION_PER_PAGE, ge=1, le=1000)
+        count: Literal["none", "approx", "exact"] = "none"
+
+    class Output(Schema):
+        items: List[Any]
+        next_cursor: str = None
+        count: Optional[int] = None
+
+    def __init__(self, ordering: Sequence[str] = ("id",), **kwargs: Any) -> None:
+        self.ordering = tuple(ordering)
+        self.fields = [field.lstrip("-") for field in self.ordering]
+        super().__init__(**kwargs)
+
+    def paginate_queryset(self, queryset: QuerySet, pagination: Input, **params):
+        count = self._count(queryset, pagination.count)
+        items = list(self._page_queryset(queryset, pagination))
+        return self._page(items, pagination, count)
+
+    async def apaginate_queryset(self, queryset: QuerySet, pagination: Input):
+        """Same as paginate_queryset, for async views."""
+        count = await sync_to_async(self._count)(queryset, pagination.count)
+        page = self._page_queryset(queryset, pagination)
+        items = [obj async for obj in page.aiterator()]
+        return self._page(items, pagination, count)
+
+    def _page_queryset(self, queryset: QuerySet, pagination: Input) -> QuerySet:
+        queryset = queryset.order_by(*self.ordering)
+        if pagination.cursor:
+            queryset = queryset.filter(self._after(queryset, pagination.cursor))
+        return queryset[: pagination.limit + 1]
+
+    def _page(self, items: list, pagination: Input, count: Optional[int]) -> dict:
+        next_cursor = None
+        if len(items) > pagination.limit:
+            items = items[: pagination.limit]
+            next_cursor = self._encode(items[-1])
+        return {"items": items, "next_cursor": next_cursor, "count": count}
+
+    def _count(self, queryset: QuerySet, mode: str) -> Optional[int]:
+        queryset = queryset.order_by()
+        if mode == "exact":
+            return queryset.count()
+        if mode == "approx":
+            if connection.vendor == "postgresql":
+                plan = json.loads(queryset.explain(format="json"))
+                return int(plan[0]["Plan"]["Plan Rows"])
+            return queryset[: self.APPROX_COUNT_LIMIT].count()
+        return None
+
+    def _encode(self, obj) -> str:
+        values = [getattr(obj, field) for field in self.fields]
+        # not DjangoJSONEncoder, which truncates datetimes to milliseconds
+        data = json.dumps(values, default=_isoformat).encode()
+        return base64.urlsafe_b64encode(data).decode()
+
+    def _decode(self, queryset: QuerySet, cursor: str) -> list:
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.fields):
+                raise ValueError(cursor)
+            return [
+                queryset.model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.fields, values)
+            ]
+        except (ValueError, TypeError, DjangoValidationError):
+            raise ValidationError(["Invalid pagination cursor!"])
+
+    def _after(self, queryset: QuerySet, cursor: str) -> Q:
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        values = self._decode(queryset, cursor)
+        condition = Q()
+        for i, (ordering, field) in enumerate(zip(self.ordering, self.fields)):
+            lookup = "lt" if ordering.startswith("-") else "gt"
+            equal = dict(zip(self.fields[:i], values[:i]))
+            condition |= Q(**equal, **{f"{field}__{lookup}": values[i]})
+        return condition
+
+
+def _isoformat(value: Any) -> str:
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
@@ -0,0 +1,77 @@
+"""
+Query plans for endpoints that serialize nested relations.
+
+Each plan joins or prefetches everything the matching output schema touches,
+so the number of queries does not grow with the number of serialized rows.
+"""
+from django.db.models import (
+    Count,
+    F,
+    IntegerField,
+    OuterRef,
+    Prefetch,
+    QuerySet,
+    Subquery,
+    Value,
+)
+from django.db.models.functions import Coalesce
+
+from .models import Section, TestResult, TestRun
+from .stats import COUNTERS
+
+
+def testresults(queryset: QuerySet = None) -> QuerySet:
+    """Plan for `TestResultOut`: testcase, section and section hierachy."""
+    if queryset is None:
+        queryset = TestResult.objects.all()
+    return queryset.with_section_hierachy("test_case__section").order_by("id")
+
+
+def testruns(queryset: QuerySet = None) -> QuerySet:
+    """Plan for `TestRunOut`: project and the full result set of each run."""
+    if queryset is None:
+        queryset = TestRun.objects.all()
+    return queryset.select_related("project").prefetch_related(
+        Prefetch("testresult_set", queryset=testresults())
+    )
+
+
+def _counted(name: str) -> Subquery:
+    """The counter `name` of a run counted from its results."""
+    results = TestResult.objects.filter(test_run=OuterRef("pk"))
+    if name != "total":
+        field, value = name.split("_", 1)
+        results = results.filter(**{field: value})
+    return Subquery(
+        results.order_by()
+        .values("test_run")
+        .annotate(count=Count("id"))
+        .values("count"),
+        output_field=IntegerField(),
+    )
+
+
+def testrun_summaries(queryset: QuerySet = None) -> QuerySet:
+    """
+    Plan for `TestRunSummaryOut`: result counts from the stats of each run.
+    Runs without stats, from bulk_create or fixtures, are counted instead.
+    """
+    if queryset is None:
+        queryset = TestRun.objects.all()
+    return queryset.select_related("project").annotate(
+        **{
+            name: Coalesce(F(f"stats__{name}"), _counted(name), Value(0))
+            for name in COUNTERS
+        }
+    )
+
+
+def section_tree() -> list:
+    """`SectionTreeOut` data of all root sections, built from one flat query."""
+    sections = Section.objects.order_by("id").values_list("id", "parent_id", "name")
+    nodes = {pk: {"id": pk, "name": name, "children": []} for pk, _, name in sections}
+    roots = []
+    for pk, parent_id, _ in sections:
+        siblings = nodes[parent_id]["children"] if parent_id else roots
+        siblings.append(nodes[pk])
+    return roots
@@ -0,0 +1,140 @@
+"""
+Ingestion of test reports into a testrun.
+
+Reports are parsed incrementally and written in batches through
+`results.record_results`, so memory stays bounded by the batch size and not
+by the size of the report.
+"""
+import json
+import re
+from collections import Counter
+from itertools import islice
+from typing import IO, Dict, Iterator, Optional
+from xml.etree import ElementTree
+
+from .models import TestResult
+from .results import record_results
+
+# TestRail style case ids inside test names, e.g. "test_login_C1234"
+CASE_ID_PATTERN = re.compile(r"(?<![A-Za-z0-9])C\d+(?![0-9])")
+CASE_ID_PROPERTIES = ("case_id", "test_id", "testrail_case_id")
+DETAILS_LENGTH = TestResult._meta.get_field("details").max_length
+
+JUNIT_STATUS = {
+    "failure": TestResult.Status.FAILED,
+    "error": TestResult.Status.FAILED,
+    "skipped": TestResult.Status.SKIPPED,
+}
+JSON_STATUS = {
+    "passed": TestResult.Status.PASSED,
+    "failed": TestResult.Status.FAILED,
+    "error": TestResult.Status.FAILED,
+    "skipped": TestResult.Status.SKIPPED,
+    "xfailed": TestResult.Status.SKIPPED,
+    "xpassed": TestResult.Status.PASSED,
+}
+
+
+def find_case_id(*names: Optional[str]) -> Optional[str]:
+    for name in names:
+        match = CASE_ID_PATTERN.search(name or "")
+        if match:
+            return match.group()
+    return None
+
+
+def parse_junit(report: IO[bytes]) -> Iterator[Dict[str, Optional[str]]]:
+    """Yield one update per <testcase>, dropping every element once it is read."""
+    parents = []
+    for event, element in ElementTree.iterparse(report, events=("start", "end")):
+        if event == "start":
+            parents.append(element)
+            continue
+        parents.pop()
+        if element.tag != "testcase":
+            continue
+
+        properties = {
+            prop.get("name"): prop.get("value")
+            for prop in element.iterfind("properties/property")
+        }
+        case_id = next(
+            (properties[name] for name in CASE_ID_PROPERTIES if properties.get(name)),
+            None,
+        ) or find_case_id(element.get("name"), element.get("classname"))
+        status, details = TestResult.Status.PASSED, ""
+        for child in element:
+            if child.tag in JUNIT_STATUS:
+                status = JUNIT_STATUS[child.tag]
+                details = child.get("message") or (child.text or "").strip()
+                break
+        yield {
+            "case_id": case_id,
+            "status": status,
+            "details": details[:DETAILS_LENGTH],
+        }
+
+        element.clear()
+        if parents:
+            parents[-1].remove(element)
+
+
+def parse_json_lines(report: IO[bytes]) -> Iterator[Dict[str, Optional[str]]]:
+    """
+    Yield one update per line of JSON. Lines are either plain results with
+    "case_id"/"name", "status" and "details", or the TestReport entries of
+    pytest's `--report-log`, of which only the deciding phase is used.
+    """
+    for line in report:
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        if entry.get("$report_type", "TestReport") != "TestReport":
+            continue
+
+        outcome = entry.get("status") or entry.get("outcome")
+        when = entry.get("when", "call")
+        if when != "call":
+            # setup and teardown only matter if they did not pass
+            if outcome == "passed":
+                continue
+            if outcome == "failed":
+                outcome = "error"
+
+        details = entry.get("details") or entry.get("longrepr") or ""
+        if isinstance(details, dict):
+            details = (details.get("reprcrash") or {}).get("message") or ""
+        elif isinstance(details, list):
+            # skip reasons are reported as [path, lineno, reason]
+            details = str(details[-1])
+        yield {
+            "case_id": entry.get("case_id")
+            or find_case_id(entry.get("name"), entry.get("nodeid")),
+            "status": JSON_STATUS.get(outcome, TestResult.Status.RETEST),
+            "details": details[:DETAILS_LENGTH],
+        }
+
+
+PARSERS = {
+    "junit": parse_junit,
+    "jsonl": parse_json_lines,
+}
+
+
+def import_report(
+    run_id: int, report: IO[bytes], format: str = "junit", batch_size: int = 500
+) -> Dict[str, int]:
+    """
+    Write a report into a testrun, one transaction per batch. Returns the
+    number of results per outcome, plus "unmapped" for tests without case id.
+    """
+    counts = Counter()
+    updates = PARSERS[format](report)
+    while True:
+        chunk = list(islice(updates, batch_size))
+        if not chunk:
+            return counts
+        batch = [update for update in chunk if update["case_id"]]
+        counts["unmapped"] += len(chunk) - len(batch)
+        if batch:
+            counts.update(outcome for _, outcome in record_results(run_id, batch))
@@ -0,0 +1,268 @@
+"""
+Bulk writes of test results, shared by the API and the report importers.
+"""
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+from django.db import connection, transaction
+from django.db.models import DateTimeField, Expression, F, QuerySet, Value
+from django.utils import timezone
+
+from . import stats
+from .cache import invalidate
+from .events import publish_added, publish_on_commit, publish_status
+from .models import TestCase, TestResult, Tombstone
+
+BATCH_SIZE = 500
+RESULT_FIELDS = ("status", "priority", "details")
+
+
+def record_results(run_id: int, updates: Iterable[Dict[str, Optional[str]]]):
+    """
+    Set status, priority and details of the results of a run, addressed by
+    `case_id`. Fields that are missing or None are left as they are.
+
+    Returns a list of `(case_id, outcome)` in the order of `updates`, where
+    outcome is "updated", "unchanged" or "unknown" (case not part of the run).
+    """
+    updates = list(updates)
+    outcomes = []
+    with transaction.atomic():
+        for i in range(0, len(updates), BATCH_SIZE):
+            outcomes += _record_batch(run_id, updates[i : i + BATCH_SIZE])
+    return outcomes
+
+
+def _record_batch(run_id: int, updates: List[Dict[str, Optional[str]]]):
+    rows = {
+        case_id: (pk, (status, priority, details))
+        for pk, case_id, status, priority, details in TestResult.objects.filter(
+            test_run_id=run_id,
+            test_case__case_id__in={update["case_id"] for update in updates},
+        ).values_list("id", "test_case__case_id", *RESULT_FIELDS)
+    }
+    original = {case_id: values for case_id, (pk, values) in rows.items()}
+
+    # later updates of the same case win
+    for update in updates:
+        if update["case_id"] not in rows:
+            continue
+        pk, values = rows[update["case_id"]]
+        rows[update["case_id"]] = pk, tuple(
+            value if update.get(field) is None else update[field]
+            for field, value in zip(RESULT_FIELDS, values)
+        )
+
+    changed = {
+        case_id for case_id, (pk, values) in rows.items() if values != original[case_id]
+    }
+    changes = dict(rows[case_id] for case_id in changed)
+    _write(changes)
+    if changes:
+        invalidate(f"testrun:{run_id}")
+    stats.adjust(
+        run_id,
+        stats.delta(
+            removed=(original[case_id][:2] for case_id in changed),
+            added=(rows[case_id][1][:2] for case_id in changed),
+        ),
+    )
+    publish_status(
+        run_id,
+        [(pk, status, priority) for pk, (status, priority, _) in changes.items()],
+    )
+
+    def outcome(case_id: str) -> str:
+        if case_id not in rows:
+            return "unknown"
+        return "updated" if case_id in changed else "unchanged"
+
+    return [(update["case_id"], outcome(update["case_id"])) for update in updates]
+
+
+def _write(changes: Dict[int, tuple]) -> None:
+    """
+    Results sharing the same new values (most of a CI run is plain "passed")
+    get one UPDATE per group, the remaining ones go through bulk_update.
+    """
+    now = timezone.now()
+    groups = defaultdict(list)
+    for pk, values in changes.items():
+        groups[values].append(pk)
+
+    single_results = []
+    for values, pks in groups.items():
+        fields = dict(zip(RESULT_FIELDS, values))
+        if len(pks) == 1:
+            single_results.append(TestResult(pk=pks[0], updated_at=now, **fields))
+        else:
+            TestResult.objects.filter(pk__in=pks).update(updated_at=now, **fields)
+    TestResult.objects.bulk_update(single_results, [*RESULT_FIELDS, "updated_at"])
+
+
+def insert_results(
+    run_id: int,
+    source: QuerySet,
+    case_field: str,
+    priority: Expression = Value(TestResult.Priority.MEDIUM),
+) -> int:
+    """
+    Add the testcases selected by `source` to a run with a single
+    INSERT .. SELECT, without loading any rows into Python. `case_field` is the
+    testcase id column of `source`. Cases already in the run are skipped.
+    Returns the number of added results.
+
+    The run stats are adjusted if all results get the same `priority` value,
+    otherwise they are counted again.
+    """
+    now = Value(timezone.now(), output_field=DateTimeField())
+    # only expressions, plain field names would be selected before all of them
+    select = source.order_by().values_list(
+        Value(run_id),
+        F(case_field),
+        Value(TestResult.Status.UNTESTED),
+        priority,
+        Value(""),
+        now,
+        now,
+    )
+    added = _insert_select(
+        TestResult,
+        (
+            "test_run",
+            "test_case",
+            "status",
+            "priority",
+            "details",
+            "created_at",
+            "updated_at",
+        ),
+        select,
+        ignore_conflicts=True,
+    )
+    if added:
+        invalidate(f"testrun:{run_id}")
+        if isinstance(priority, Value):
+            stats.adjust(
+                run_id,
+                stats.delta(
+                    added=[(TestResult.Status.UNTESTED, priority.value)], count=added
+                ),
+            )
+        else:
+            stats.recount([run_id])
+    publish_added(run_id, added)
+    return added
+
+
+def _insert_select(
+    model, fields: Iterable[str], select: QuerySet, ignore_conflicts: bool = False
+) -> int:
+    sql, params = select.query.sql_with_params()
+    columns = [model._meta.get_field(field).column for field in fields]
+    statement = (
+        f"INSERT INTO {model._meta.db_table} ({', '.join(columns)}) "
+        f"SELECT * FROM ({sql}) AS source"
+    )
+    if ignore_conflicts:
+        # the WHERE keeps SQLite from reading ON CONFLICT as part of a join
+        statement += " WHERE true ON CONFLICT DO NOTHING"
+    with connection.cursor() as cursor:
+        cursor.execute(statement, params)
+        return cursor.rowcount
+
+
+class Deleting(threading.local):
+    """Testcases and results deleted in bulk, whose deletion is recorded."""
+
+    def __init__(self) -> None:
+        self.cases: Set[int] = set()
+        self.results: Set[int] = set()
+
+
+deleting = Deleting()
+
+
+def recorded_in_bulk(result: TestResult, origin=None) -> bool:
+    """
+    Whether the deletion of `result` was recorded in bulk, by `delete_results`
+    or, for results deleted along with their run or testcase, by the pre_delete
+    receivers of those. `origin` is what the delete was called on.
+    """
+    if result.pk in deleting.results:
+        return True
+    if isinstance(origin, QuerySet):
+        origin = origin.model
+    # cascaded from a run or testcase, or from a project through its runs
+    return not (origin is TestResult or isinstance(origin, TestResult))
+
+
+def record_tombstones(queryset: QuerySet) -> None:
+    """Tombstones of the rows of `queryset` with a single INSERT .. SELECT."""
+    now = Value(timezone.now(), output_field=DateTimeField())
+    _insert_select(
+        Tombstone,
+        ("model", "object_id", "deleted_at"),
+        queryset.order_by().values_list(
+            Value(queryset.model._meta.model_name), F("id"), now
+        ),
+    )
+
+
+def record_deletion(results: QuerySet, run_deleted: bool = False) -> List[int]:
+    """
+    Record the deletion of `results` before they are deleted: tombstones with
+    a single INSERT .. SELECT, and per run one stats adjustment, one cache
+    invalidation and the removed events. Nothing but tombstones is needed if
+    the run is deleted as well. Returns the ids of the results.
+    """
+    record_tombstones(results)
+    if run_deleted:
+        return []
+
+    removed = defaultdict(list)
+    for pk, run_id, status, priority in results.values_list(
+        "id", "test_run_id", "status", "priority"
+    ):
+        removed[run_id].append((pk, status, priority))
+    for run_id, rows in removed.items():
+        # runs without stats are left to repair_stats, a recount would still
+        # see the results
+        stats.adjust(
+            run_id,
+            stats.delta(removed=[row[1:] for row in rows]),
+            recount_missing=False,
+        )
+        invalidate(f"testrun:{run_id}")
+        for pk, _, _ in rows:
+            publish_on_commit(run_id, {"type": "removed", "id": pk})
+    return [row[0] for rows in removed.values() for row in rows]
+
+
+def delete_results(results: QuerySet) -> List[int]:
+    """Delete results in bulk, returns their ids."""
+    with transaction.atomic():
+        pks = record_deletion(results)
+        deleting.results.update(pks)
+        try:
+            TestResult.objects.filter(id__in=pks).delete()
+        finally:
+            deleting.results.difference_update(pks)
+    return pks
+
+
+def delete_testcases(pks: List[int]) -> None:
+    """
+    Delete testcases and their results in bulk, with one query per kind of
+    record instead of the receivers per testcase.
+    """
+    with transaction.atomic():
+        delete_results(TestResult.objects.filter(test_case_id__in=pks))
+        record_tombstones(TestCase.objects.filter(id__in=pks))
+        deleting.cases.update(pks)
+        try:
+            TestCase.objects.filter(id__in=pks).delete()
+        finally:
+            deleting.cases.difference_update(pks)
+    invalidate("testcases")
@@ -1,10 +1,10 @@
 from datetime import datetime
 
-from typing import List, Union
+from typing import Dict, List, Union
 
-from ninja import Field, Schema
+from ninja import Field, FilterSchema, Schema
 
-from .models import TestRun, TestCase
+from .models import TestRun, TestCase, TestResult
 
 
 class ProjectOut(Schema):
@@ -91,6 +91,31 @@ class TestResultOut(Schema):
     updated_at: datetime
 
 
+class TestResultIn(Schema):
+    case_id: str
+    status: TestResult.Status = None
+    priority: TestResult.Priority = None
+    details: str = Field(None, max_length=255)
+
+
+class TestResultOutcomeOut(Schema):
+    case_id: str
+    outcome: str
+
+
+class TestRunAddCasesOut(Schema):
+    added: List[int]
+    present: List[int]
+    unknown: List[int]
+
+
+class ReportImportOut(Schema):
+    updated: int = 0
+    unchanged: int = 0
+    unknown: int = 0
+    unmapped: int = 0
+
+
 class TestRunIn(Schema):
     project_id: int
     title: str
@@ -98,6 +123,13 @@ class TestRunIn(Schema):
     environment: TestRun.Environment
 
 
+class TestRunCloneIn(Schema):
+    title: str = None
+    description: str = None
+    environment: TestRun.Environment = None
+    statuses: List[TestResult.Status] = None
+
+
 class TestRunOut(Schema):
     id: int
     project: ProjectOut
@@ -107,3 +139,121 @@ class TestRunOut(Schema):
     testresult_set: List[TestResultOut]
     created_at: datetime
     updated_at: datetime
+
+
+class TestRunFilter(FilterSchema):
+    project: str = Field(None, q="project__slug")
+    environment: TestRun.Environment = None
+    created_after: datetime = Field(None, q="created_at__gte")
+    created_before: datetime = Field(None, q="created_at__lt")
+
+
+class TestRunSummaryOut(Schema):
+    id: int
+    project: ProjectOut
+    title: str
+    description: str
+    environment: str = Field(None, alias="get_environment_display")
+    total: int
+    status_counts: Dict[str, int]
+    priority_counts: Dict[str, int]
+    created_at: datetime
+    updated_at: datetime
+
+    @staticmethod
+    def resolve_status_counts(obj):
+        return {
+            status: getattr(obj, f"status_{status}")
+            for status in TestResult.Status.values
+        }
+
+    @staticmethod
+    def resolve_priority_counts(obj):
+        return {
+            priority: getattr(obj, f"priority_{priority}")
+            for priority in TestResult.Priority.values
+        }
+
+
+class TestCaseChangeOut(Schema):
+    id: int
+    case_id: str
+    title: str
+    is_automation: bool
+    section_id: int = None
+    expected_result: str
+    preconditions: str
+    type: str
+    created_at: datetime
+    updated_at: datetime
+
+
+class TestRunChangeOut(Schema):
+    id: int
+    project_id: int
+    title: str
+    description: str
+    environment: str
+    created_at: datetime
+    updated_at: datetime
+
+
+class TestResultChangeOut(Schema):
+    id: int
+    test_run_id: int
+    test_case_id: int
+    status: str
+    priority: str
+    details: str
+    created_at: datetime
+    updated_at: datetime
+
+
+class TombstoneOut(Schema):
+    model: str
+    object_id: int
+    deleted_at: datetime
+
+
+class ChangesOut(Schema):
+    cursor: str = None
+    has_more: bool
+    testcases: List[TestCaseChangeOut]
+    testruns: List[TestRunChangeOut]
+    testresults: List[TestResultChangeOut]
+    deleted: List[TombstoneOut]
+
+
+class SectionPageOut(Schema):
+    items: List[SectionOut]
+    next_cursor: str = None
+    count: int = None
+
+
+class TestCasePageOut(Schema):
+    items: List[TestCaseOut]
+    next_cursor: str = None
+    count: int = None
+
+
+class TestRunSummaryPageOut(Schema):
+    items: List[TestRunSummaryOut]
+    next_cursor: str = None
+    count: int = None
+
+
+class FlakinessOut(Schema):
+    id: int
+    case_id: str
+    title: str
+    executions: int
+    pass_rate: float
+    flips: int
+    last_statuses: List[TestResult.Status]
+    last_failed_at: datetime = None
+    seconds_since_failure: float = None
+
+
+class FlakinessPageOut(Schema):
+    items: List[FlakinessOut]
+    count: int
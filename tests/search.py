@@ -0,0 +1,108 @@
+"""
+Testcase search backends.
+
+The backend is chosen by the `SEARCH_BACKEND` setting (a dotted path) or, if
+that is not set, by the database vendor. Every backend returns a queryset of
+testcases ordered by relevance, so it can be paginated like any other listing.
+"""
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q, QuerySet
+from django.utils.module_loading import import_string
+
+from .models import Section, TestCase
+
+FTS_TABLE = "tests_testcase_fts"
+
+
+class SearchBackend:
+    def search(self, query: str) -> QuerySet:
+        raise NotImplementedError
+
+
+class SimpleSearchBackend(SearchBackend):
+    """Unindexed substring search, works on every database."""
+
+    def search(self, query: str) -> QuerySet:
+        return TestCase.objects.filter(
+            Q(title__icontains=query)
+            | Q(section__name__icontains=query)
+            | Q(case_id__icontains=query)
+        ).order_by("id")
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+    FTS5 search with the trigram tokenizer, which keeps the substring matching
+    of the simple backend but answers it from an index and ranks with bm25.
+    The index table is kept in sync by triggers, see migration 0004.
+    """
+
+    fallback = SimpleSearchBackend()
+
+    def search(self, query: str) -> QuerySet:
+        terms = re.findall(r"\w+", query)
+        # trigrams can not match terms shorter than three characters
+        if not terms or any(len(term) < 3 for term in terms):
+            return self.fallback.search(query)
+
+        match = " ".join(f'"{term}"' for term in terms)
+        return TestCase.objects.extra(
+            select={"rank": f"{FTS_TABLE}.rank"},
+            tables=[FTS_TABLE],
+            where=[f"{FTS_TABLE}.rowid = tests_testcase.id", f"{FTS_TABLE} MATCH %s"],
+            params=[match],
+            order_by=["rank", "id"],
+        )
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Substring matching answered by the pg_trgm indexes of migration 0004,
+    ranked by full text relevance and title similarity.
+    """
+
+    def search(self, query: str) -> QuerySet:
+        from django.contrib.postgres.search import (
+            SearchQuery,
+            SearchRank,
+            SearchVector,
+            TrigramSimilarity,
+        )
+
+        vector = (
+            SearchVector("title", weight="A", config="simple")
+            + SearchVector("case_id", weight="A", config="simple")
+            + SearchVector("section__name", weight="B", config="simple")
+        )
+        search_query = SearchQuery(query, search_type="websearch", config="simple")
+        return (
+            TestCase.objects.filter(
+                Q(title__icontains=query)
+                | Q(case_id__icontains=query)
+                | Q(section_id__in=Section.objects.filter(name__icontains=query))
+            )
+            .annotate(
+                rank=SearchRank(vector, search_query)
+                + TrigramSimilarity("title", query)
+            )
+            .order_by("-rank", "id")
+        )
+
+
+@lru_cache(maxsize=None)
+def get_search_backend() -> SearchBackend:
+    backend_path = getattr(settings, "SEARCH_BACKEND", None)
+    if backend_path:
+        return import_string(backend_path)()
+    if connection.vendor == "postgresql":
+        return PostgresSearchBackend()
+    if (
+        connection.vendor == "sqlite"
+        and FTS_TABLE in connection.introspection.table_names()
+    ):
+        return SQLiteSearchBackend()
+    return SimpleSearchBackend()
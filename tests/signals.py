@@ -0,0 +1,136 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import stats
+from .cache import invalidate
+from .events import publish_added, publish_on_commit, publish_status
+from .models import (
+    Project,
+    Section,
+    TestCase,
+    TestResult,
+    TestRun,
+    TestRunStats,
+    Tombstone,
+)
+from .results import deleting, record_deletion, recorded_in_bulk
+
+
+@receiver(post_save, sender=Section)
+@receiver(post_delete, sender=Section)
+def invalidate_sections(sender, **kwargs):
+    invalidate("sections")
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def invalidate_projects(sender, **kwargs):
+    invalidate("projects")
+
+
+@receiver(post_save, sender=TestCase)
+@receiver(post_delete, sender=TestCase)
+def invalidate_testcases(sender, instance, **kwargs):
+    # results.delete_testcases invalidates once for all of them
+    if instance.pk in deleting.cases:
+        return
+    invalidate("testcases")
+
+
+@receiver(post_save, sender=TestRun)
+@receiver(post_delete, sender=TestRun)
+def invalidate_testrun(sender, instance, **kwargs):
+    invalidate(f"testrun:{instance.pk}")
+
+
+@receiver(post_save, sender=TestResult)
+@receiver(post_delete, sender=TestResult)
+def invalidate_testrun_results(sender, instance, signal, origin=None, **kwargs):
+    if signal is post_delete and recorded_in_bulk(instance, origin):
+        return
+    invalidate(f"testrun:{instance.test_run_id}")
+
+
+@receiver(pre_delete, sender=TestRun)
+def record_run_results_deletion(sender, instance, **kwargs):
+    # the cascaded results are recorded at once, not by the receivers per result
+    record_deletion(TestResult.objects.filter(test_run=instance), run_deleted=True)
+
+
+@receiver(pre_delete, sender=TestCase)
+def record_testcase_results_deletion(sender, instance, **kwargs):
+    if instance.pk in deleting.cases:
+        return
+    record_deletion(TestResult.objects.filter(test_case=instance))
+
+
+@receiver(post_delete, sender=TestCase)
+@receiver(post_delete, sender=TestRun)
+@receiver(post_delete, sender=TestResult)
+def record_tombstone(sender, instance, origin=None, **kwargs):
+    if sender is TestResult and recorded_in_bulk(instance, origin):
+        return
+    if sender is TestCase and instance.pk in deleting.cases:
+        return
+    Tombstone.objects.create(model=sender._meta.model_name, object_id=instance.pk)
+
+
+@receiver(post_save, sender=TestResult)
+def publish_result(sender, instance, created, **kwargs):
+    if created:
+        publish_added(instance.test_run_id, 1)
+    else:
+        publish_status(
+            instance.test_run_id, [(instance.pk, instance.status, instance.priority)]
+        )
+
+
+@receiver(post_delete, sender=TestResult)
+def publish_removed_result(sender, instance, origin=None, **kwargs):
+    if recorded_in_bulk(instance, origin):
+        return
+    publish_on_commit(instance.test_run_id, {"type": "removed", "id": instance.pk})
+
+
+@receiver(post_delete, sender=TestRun)
+def publish_deleted_run(sender, instance, **kwargs):
+    publish_on_commit(instance.pk, {"type": "deleted"})
+
+
+@receiver(post_save, sender=TestRun)
+def create_stats(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        TestRunStats.objects.create(test_run=instance)
+
+
+@receiver(post_save, sender=TestResult)
+def count_saved_result(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    current = (instance.test_run_id, instance.status, instance.priority)
+    if created:
+        stats.adjust(instance.test_run_id, stats.delta(added=[current[1:]]))
+    elif None in getattr(instance, "_counted", (None,)):
+        # not loaded with all counted values, what changed is unknown
+        stats.recount([instance.test_run_id])
+    elif instance._counted[0] != instance.test_run_id:
+        stats.adjust(instance._counted[0], stats.delta(removed=[instance._counted[1:]]))
+        stats.adjust(instance.test_run_id, stats.delta(added=[current[1:]]))
+    else:
+        stats.adjust(
+            instance.test_run_id,
+            stats.delta(removed=[instance._counted[1:]], added=[current[1:]]),
+        )
+    instance._counted = current
+
+
+@receiver(post_delete, sender=TestResult)
+def count_deleted_result(sender, instance, origin=None, **kwargs):
+    # adjusted per run by record_deletion, or deleted along with the run
+    if recorded_in_bulk(instance, origin):
+        return
+    stats.adjust(
+        instance.test_run_id,
+        stats.delta(removed=[(instance.status, instance.priority)]),
+        recount_missing=False,
+    )
@@ -0,0 +1,118 @@
+"""
+Result counts per testrun.
+
+`TestRunStats` holds the number of results of a run per status and priority,
+so a summary reads one row instead of counting the results of the run. The
+signals adjust the counts with F() expressions for every saved or deleted
+result, the bulk writes and deletes in `results` adjust them once per run and
+batch, and nothing is adjusted for the results of a deleted run. `recount`
+counts the results of runs again, the `repair_stats` command does so for all
+runs.
+"""
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db.models import Count, F, Q
+
+from .models import TestResult, TestRun, TestRunStats
+
+COUNTERS = [
+    "total",
+    *(f"status_{status}" for status in TestResult.Status.values),
+    *(f"priority_{priority}" for priority in TestResult.Priority.values),
+]
+BATCH_SIZE = 500
+
+
+def counts() -> Dict[str, Count]:
+    """Aggregates of `COUNTERS` over the results of runs."""
+    aggregates = {"total": Count("testresult")}
+    aggregates.update(
+        {
+            f"status_{status}": Count("testresult", filter=Q(testresult__status=status))
+            for status in TestResult.Status.values
+        }
+    )
+    aggregates.update(
+        {
+            f"priority_{priority}": Count(
+                "testresult", filter=Q(testresult__priority=priority)
+            )
+            for priority in TestResult.Priority.values
+        }
+    )
+    return aggregates
+
+
+def delta(
+    removed: Iterable[Tuple[str, str]] = (),
+    added: Iterable[Tuple[str, str]] = (),
+    count: int = 1,
+) -> Counter:
+    """
+    Changes of the counters for removed and added `(status, priority)` pairs,
+    each of them `count` times.
+    """
+    changes = Counter()
+    for sign, results in ((-count, removed), (count, added)):
+        for status, priority in results:
+            # update() keeps negative counts, unlike +
+            changes.update(
+                {"total": sign, f"status_{status}": sign, f"priority_{priority}": sign}
+            )
+    return changes
+
+
+def adjust(run_id: int, changes: Counter, recount_missing: bool = True) -> None:
+    """
+    Add `changes` to the counters of a run in a single UPDATE. Runs without
+    stats, e.g. from bulk_create, are counted from scratch instead.
+    """
+    fields = {name: F(name) + value for name, value in changes.items() if value}
+    if not fields:
+        return
+    updated = TestRunStats.objects.filter(test_run_id=run_id).update(**fields)
+    if not updated and recount_missing:
+        recount([run_id])
+
+
+def recount(run_ids: Optional[List[int]] = None) -> int:
+    """
+    Count the results of the given runs, or of all runs, and write the counts.
+    Returns the number of runs whose stats were wrong or missing.
+    """
+    runs = TestRun.objects.order_by("id")
+    if run_ids is not None:
+        runs = runs.filter(id__in=run_ids)
+    rows = runs.annotate(**counts()).values_list("id", *COUNTERS)
+
+    repaired = 0
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            repaired += _write(batch)
+            batch = []
+    if batch:
+        repaired += _write(batch)
+    return repaired
+
+
+def _write(rows: List[tuple]) -> int:
+    stored = {
+        row[0]: row
+        for row in TestRunStats.objects.filter(
+            test_run_id__in=[row[0] for row in rows]
+        ).values_list("test_run_id", *COUNTERS)
+    }
+    wrong = [row for row in rows if stored.get(row[0]) != row]
+    TestRunStats.objects.bulk_create(
+        [
+            TestRunStats(test_run_id=pk, **dict(zip(COUNTERS, values)))
+            for pk, *values in wrong
+        ],
+        update_conflicts=True,
+        unique_fields=["test_run"],
+        update_fields=COUNTERS,
+    )
+    return len(wrong)